@@ -21,7 +21,10 @@ import {
 import { Badge } from "@/components/ui/badge";
 import { useToast } from "@/hooks/use-toast";
 import { apiService } from "@/services/api";
-import { Receipt } from "@/types/receipt";
+import { DeliveryStatus, Receipt } from "@/types/receipt";
+
+// The dashboard loads one page of the newest receipts, then keeps it current from the server's change feed
+const PAGE_SIZE = 50;
 
 export default function DashboardPage() {
   const [receipts, setReceipts] = useState<Receipt[]>([]);
@@ -29,6 +32,7 @@ export default function DashboardPage() {
   const [error, setError] = useState<string | null>(null);
   const [searchQuery, setSearchQuery] = useState("");
   const [selectedReceipt, setSelectedReceipt] = useState<Receipt | null>(null);
+  const [deliveryStatus, setDeliveryStatus] = useState<Record<number, DeliveryStatus>>({});
   const { toast } = useToast();
 
   const fetchReceipts = async () => {
@@ -36,8 +40,12 @@ export default function DashboardPage() {
     setError(null);
 
     try {
-      const data = await apiService.getAllReceipts();
-      setReceipts(data);
+      const data = await apiService.getReceiptsPage(PAGE_SIZE);
+      // Keep anything the change feed already pushed while this request was in flight
+      setReceipts((current) => {
+        const loadedIds = new Set(data.map((r) => r.id));
+        return [...current.filter((r) => !loadedIds.has(r.id)), ...data];
+      });
     } catch (err) {
       const message = err instanceof Error ? err.message : "Failed to fetch receipts";
       setError(message);
@@ -52,7 +60,30 @@ export default function DashboardPage() {
   };
 
   useEffect(() => {
+    // Subscribe first, then load the page, so a receipt created in between isn't missed
+    const unsubscribe = apiService.subscribeToReceiptChanges({
+      onCreated: (receipt) =>
+        setReceipts((current) =>
+          current.some((r) => r.id === receipt.id) ? current : [receipt, ...current]
+        ),
+      onPdfUpdated: ({ id, pdf_url }) => {
+        setReceipts((current) => current.map((r) => (r.id === id ? { ...r, pdf_url } : r)));
+        setSelectedReceipt((current) => (current && current.id === id ? { ...current, pdf_url } : current));
+      },
+      onDelivery: ({ id, status }) =>
+        setDeliveryStatus((current) => ({
+          ...current,
+          // One successful provider is enough, don't let a later failure from the other one overwrite it
+          [id]: current[id] === "sent" ? "sent" : status,
+        })),
+      onReset: () => {
+        setReceipts([]);
+        fetchReceipts();
+      },
+    });
+
     fetchReceipts();
+    return unsubscribe;
   }, []);
 
   const filteredReceipts = useMemo(() => {
@@ -111,7 +142,7 @@ export default function DashboardPage() {
               <h1 className="font-display text-3xl font-bold text-foreground">Dashboard</h1>
             </div>
             <p className="text-muted-foreground">
-              View and manage all generated receipts
+              Latest receipts, updated live as new ones come in
             </p>
           </div>
 
@@ -217,7 +248,24 @@ export default function DashboardPage() {
                             <p className="text-xs text-muted-foreground">{receipt.customer_email}</p>
                           </div>
                         </TableCell>
-                        <TableCell className="hidden md:table-cell">{receipt.business_store}</TableCell>
+                        <TableCell className="hidden md:table-cell">
+                          <div>
+                            <p>{receipt.business_store}</p>
+                            {deliveryStatus[receipt.id] && (
+                              <p
+                                className={`text-xs ${
+                                  deliveryStatus[receipt.id] === "sent" ? "text-accent" : "text-destructive"
+                                }`}
+                              >
+                                {deliveryStatus[receipt.id] === "sent"
+                                  ? "Email sent"
+                                  : deliveryStatus[receipt.id] === "quota_exceeded"
+                                    ? "Email quota reached"
+                                    : "Email failed"}
+                              </p>
+                            )}
+                          </div>
+                        </TableCell>
                         <TableCell className="hidden sm:table-cell">
                           <Badge variant="outline" className={getPaymentMethodColor(receipt.payment_method)}>
                             {receipt.payment_method}
@@ -127,17 +127,23 @@ export default function GeneratePage() {
                 <p className="text-sm text-muted-foreground">
                   Check your email at <span className="font-medium">{form.getValues("customer_email") || "the provided address"}</span>
                 </p>
-                <p className="text-sm text-muted-foreground mt-1">
-                  PDF URL:{" "}
-                  <a
-                    href={successData.Pdf_Url}
-                    target="_blank"
-                    rel="noopener noreferrer"
-                    className="text-accent hover:underline break-all"
-                  >
-                    {successData.Pdf_Url}
-                  </a>
-                </p>
+                {successData.Pdf_Url ? (
+                  <p className="text-sm text-muted-foreground mt-1">
+                    PDF URL:{" "}
+                    <a
+                      href={successData.Pdf_Url}
+                      target="_blank"
+                      rel="noopener noreferrer"
+                      className="text-accent hover:underline break-all"
+                    >
+                      {successData.Pdf_Url}
+                    </a>
+                  </p>
+                ) : (
+                  <p className="text-sm text-muted-foreground mt-1">
+                    The PDF upload is being retried, the email goes out as soon as it succeeds.
+                  </p>
+                )}
               </div>
             </CardContent>
           </Card>
@@ -1,4 +1,9 @@
-import { Receipt, ReceiptCreate, ReceiptCreateResponse } from "@/types/receipt";
+import {
+  Receipt,
+  ReceiptChangeHandlers,
+  ReceiptCreate,
+  ReceiptCreateResponse,
+} from "@/types/receipt";
 
 // API Base URL - Change this to your production URL when deploying
 export const API_BASE_URL = "https://receiptflow-production.up.railway.app" //"http://127.0.0.1:8000";
@@ -28,6 +33,9 @@ class ApiService {
       if (response.status === 400) {
         throw new Error(`Validation error: ${errorMessage}`);
       }
+      if (response.status === 429) {
+        throw new Error("Too many receipts from this store right now. Please retry in a few seconds.");
+      }
       if (response.status === 404) {
         throw new Error("Resource not found.");
       }
@@ -82,6 +90,43 @@ class ApiService {
     }
   }
 
+  // Newest receipts first, one page at a time. The dashboard loads one page then follows subscribeToReceiptChanges
+  async getReceiptsPage(limit: number, beforeId?: number): Promise<Receipt[]> {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (beforeId !== undefined) params.set("before_id", String(beforeId));
+
+    try {
+      const response = await fetch(`${this.baseUrl}/receipts?${params}`, {
+        method: "GET",
+        headers: {
+          "Content-Type": "application/json",
+        },
+      });
+
+      return this.handleResponse<Receipt[]>(response);
+    } catch (error) {
+      if (error instanceof TypeError && error.message === "Failed to fetch") {
+        throw new Error(
+          "⚠️ Backend not connected. Make sure FastAPI is running on Railway"
+        );
+      }
+      throw error;
+    }
+  }
+
+  // Server-Sent Events. EventSource reconnects on its own and sends Last-Event-ID, so the backend replays what was missed.
+  // Returns a function that closes the stream.
+  subscribeToReceiptChanges(handlers: ReceiptChangeHandlers): () => void {
+    const source = new EventSource(`${this.baseUrl}/receipts/changes`);
+
+    source.addEventListener("receipt.created", (e) => handlers.onCreated(JSON.parse((e as MessageEvent).data)));
+    source.addEventListener("receipt.pdf_updated", (e) => handlers.onPdfUpdated(JSON.parse((e as MessageEvent).data)));
+    source.addEventListener("receipt.delivery", (e) => handlers.onDelivery(JSON.parse((e as MessageEvent).data)));
+    source.addEventListener("reset", () => handlers.onReset());
+
+    return () => source.close();
+  }
+
   async getReceiptById(receiptId: number): Promise<Receipt> {
     try {
       const response = await fetch(`${this.baseUrl}/receipts/${receiptId}`, {
@@ -23,7 +23,8 @@ export interface ReceiptCreateResponse {
   id: number;
   order_id: string;
   receipt_number: string;
-  Pdf_Url: string; // Note: Capital P as per backend response
+  Pdf_Url: string | null; // Note: Capital P as per backend response. null when the upload is being retried (HTTP 202)
+  upload_status?: "retrying";
 }
 
 export interface Receipt {
@@ -42,6 +43,28 @@ export interface Receipt {
   items: ReceiptItemWithId[];
 }
 
+// Events pushed by GET /receipts/changes (Server-Sent Events)
+export type DeliveryStatus = "sent" | "failed" | "quota_exceeded";
+
+export interface ReceiptPdfUpdatedEvent {
+  id: number;
+  pdf_url: string;
+}
+
+export interface ReceiptDeliveryEvent {
+  id: number;
+  provider: "smtp" | "resend";
+  status: DeliveryStatus;
+  error?: string;
+}
+
+export interface ReceiptChangeHandlers {
+  onCreated: (receipt: Receipt) => void;
+  onPdfUpdated: (event: ReceiptPdfUpdatedEvent) => void;
+  onDelivery: (event: ReceiptDeliveryEvent) => void;
+  onReset: () => void; // Too far behind to replay, reload the page
+}
+
 export type PaymentMethod = "Card" | "Transfer" | "Crypto-Currency";
 
 export const PAYMENT_METHODS: PaymentMethod[] = ["Card", "Transfer", "Crypto-Currency"];
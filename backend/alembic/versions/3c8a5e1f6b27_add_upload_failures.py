@@ -0,0 +1,41 @@
+"""add upload failures
+
+Revision ID: 3c8a5e1f6b27
+Revises: b41e7c09d5a3
+Create Date: 2026-10-19 15:40:27.260917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c8a5e1f6b27'
+down_revision: Union[str, Sequence[str], None] = 'b41e7c09d5a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'upload_failures',
+        sa.Column('receipt_id', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['receipt_id'], ['order_receipts.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('receipt_id'),
+    )
+    op.create_index(op.f('ix_upload_failures_next_attempt_at'), 'upload_failures', ['next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_upload_failures_next_attempt_at'), table_name='upload_failures')
+    op.drop_table('upload_failures')
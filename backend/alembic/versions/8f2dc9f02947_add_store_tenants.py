@@ -0,0 +1,64 @@
+"""add store tenants and usage
+
+Revision ID: 8f2dc9f02947
+Revises: d9ba59a8783a
+Create Date: 2026-10-19 12:05:41.093112
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f2dc9f02947'
+down_revision: Union[str, Sequence[str], None] = 'd9ba59a8783a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'store_tenants',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('api_key_hash', sa.String(), nullable=False),
+        sa.Column('rate_per_second', sa.Float(), nullable=False),
+        sa.Column('burst', sa.Integer(), nullable=False),
+        sa.Column('daily_email_quota', sa.Integer(), nullable=True),
+        sa.Column('active', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'),
+    )
+    op.create_index(op.f('ix_store_tenants_id'), 'store_tenants', ['id'], unique=False)
+    op.create_index(op.f('ix_store_tenants_api_key_hash'), 'store_tenants', ['api_key_hash'], unique=True)
+
+    op.create_table(
+        'tenant_usage',
+        sa.Column('tenant_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('receipts', sa.Integer(), nullable=False),
+        sa.Column('renders', sa.Integer(), nullable=False),
+        sa.Column('emails', sa.Integer(), nullable=False),
+        sa.Column('rate_limited', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['tenant_id'], ['store_tenants.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('tenant_id', 'day'),
+    )
+
+    op.add_column('order_receipts', sa.Column('tenant_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_order_receipts_tenant_id'), 'order_receipts', ['tenant_id'], unique=False)
+    op.create_foreign_key('fk_order_receipts_tenant_id', 'order_receipts', 'store_tenants', ['tenant_id'], ['id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('fk_order_receipts_tenant_id', 'order_receipts', type_='foreignkey')
+    op.drop_index(op.f('ix_order_receipts_tenant_id'), table_name='order_receipts')
+    op.drop_column('order_receipts', 'tenant_id')
+    op.drop_table('tenant_usage')
+    op.drop_index(op.f('ix_store_tenants_api_key_hash'), table_name='store_tenants')
+    op.drop_index(op.f('ix_store_tenants_id'), table_name='store_tenants')
+    op.drop_table('store_tenants')
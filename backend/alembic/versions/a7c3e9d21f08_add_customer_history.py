@@ -0,0 +1,50 @@
+"""add customer email key and summaries
+
+Revision ID: a7c3e9d21f08
+Revises: 6d1f0a4b9e52
+Create Date: 2026-10-19 18:27:14.904213
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c3e9d21f08'
+down_revision: Union[str, Sequence[str], None] = '6d1f0a4b9e52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('order_receipts', sa.Column('customer_email_key', sa.String(), nullable=True))
+    op.execute("UPDATE order_receipts SET customer_email_key = lower(trim(customer_email))")
+    op.alter_column('order_receipts', 'customer_email_key', nullable=False)
+    op.create_index('ix_order_receipts_customer_email_key_id', 'order_receipts', ['customer_email_key', 'id'], unique=False)
+
+    op.create_table(
+        'customer_summaries',
+        sa.Column('customer_email_key', sa.String(), nullable=False),
+        sa.Column('business_store', sa.String(), nullable=False),
+        sa.Column('order_count', sa.Integer(), nullable=False),
+        sa.Column('total_spend', sa.Float(), nullable=False),
+        sa.Column('first_purchase_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_purchase_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('customer_email_key', 'business_store'),
+    )
+    # Existing receipts, from here on the summaries are maintained as receipts are inserted
+    op.execute(
+        "INSERT INTO customer_summaries (customer_email_key, business_store, order_count, total_spend, first_purchase_at, last_purchase_at) "
+        "SELECT customer_email_key, business_store, count(*), sum(total), min(created_at), max(created_at) "
+        "FROM order_receipts GROUP BY customer_email_key, business_store"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('customer_summaries')
+    op.drop_index('ix_order_receipts_customer_email_key_id', table_name='order_receipts')
+    op.drop_column('order_receipts', 'customer_email_key')
@@ -0,0 +1,42 @@
+"""add store brandings
+
+Revision ID: b41e7c09d5a3
+Revises: 8f2dc9f02947
+Create Date: 2026-10-19 14:22:10.518334
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b41e7c09d5a3'
+down_revision: Union[str, Sequence[str], None] = '8f2dc9f02947'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'store_brandings',
+        sa.Column('business_store', sa.String(), nullable=False),
+        sa.Column('theme', sa.String(), nullable=False),
+        sa.Column('brand_name', sa.String(), nullable=True),
+        sa.Column('branding_text', sa.String(), nullable=True),
+        sa.Column('watermark_text', sa.String(), nullable=True),
+        sa.Column('footer_text', sa.String(), nullable=True),
+        sa.Column('primary_color', sa.String(), nullable=True),
+        sa.Column('primary_dark_color', sa.String(), nullable=True),
+        sa.Column('accent_color', sa.String(), nullable=True),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('business_store'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('store_brandings')
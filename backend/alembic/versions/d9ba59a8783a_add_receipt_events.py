@@ -0,0 +1,41 @@
+"""add receipt_events change feed
+
+Revision ID: d9ba59a8783a
+Revises: e9219c2506a8
+Create Date: 2026-10-19 11:40:12.418230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9ba59a8783a'
+down_revision: Union[str, Sequence[str], None] = 'e9219c2506a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'receipt_events',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('receipt_id', sa.Integer(), nullable=False),
+        sa.Column('event_type', sa.String(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['receipt_id'], ['order_receipts.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_receipt_events_id'), 'receipt_events', ['id'], unique=False)
+    op.create_index(op.f('ix_receipt_events_receipt_id'), 'receipt_events', ['receipt_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_receipt_events_receipt_id'), table_name='receipt_events')
+    op.drop_index(op.f('ix_receipt_events_id'), table_name='receipt_events')
+    op.drop_table('receipt_events')
@@ -0,0 +1,28 @@
+"""index receipt events created_at
+
+Revision ID: f3b8d61c4a90
+Revises: a7c3e9d21f08
+Create Date: 2026-10-19 20:14:07.318562
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b8d61c4a90'
+down_revision: Union[str, Sequence[str], None] = 'a7c3e9d21f08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_receipt_events_created_at'), 'receipt_events', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_receipt_events_created_at'), table_name='receipt_events')
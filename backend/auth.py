@@ -0,0 +1,16 @@
+import os
+import hmac
+from typing import Optional
+from fastapi import Header, HTTPException
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Admin endpoints (bulk reissue etc.) are only switched on when ADMIN_API_KEY is set, and callers send it as "X-Admin-Key"
+def require_admin(x_admin_key: Optional[str] = Header(default=None)):
+  admin_key = os.getenv("ADMIN_API_KEY")
+  if not admin_key:
+    raise HTTPException(status_code=403, detail="Admin API is disabled (ADMIN_API_KEY not set)")
+  if not x_admin_key or not hmac.compare_digest(x_admin_key, admin_key):
+    raise HTTPException(status_code=401, detail="Invalid admin key")
@@ -0,0 +1,325 @@
+# Load + micro benchmarks for the receipt pipeline.
+#
+# Run from the backend/ folder:
+#   python -m benchmarks.run_benchmarks load --requests 200 --concurrency 8
+#   python -m benchmarks.run_benchmarks micro
+#   python -m benchmarks.run_benchmarks pdf    (bytes per PDF output profile, needs wkhtmltopdf)
+#   python -m benchmarks.run_benchmarks all --save-baseline benchmarks/baseline.json
+#   python -m benchmarks.run_benchmarks all --baseline benchmarks/baseline.json   (exits 1 on regression)
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stand_ins import install_stand_ins, recorder, wkhtmltopdf_available
+
+
+PIPELINE_STAGES = ["db_insert", "html_render", "pdf_render", "upload", "db_update", "email_enqueue"]
+
+
+def percentile(sorted_values, pct):
+  if not sorted_values:
+    return 0.0
+  k = (len(sorted_values) - 1) * (pct / 100)
+  lower = int(k)
+  upper = min(lower + 1, len(sorted_values) - 1)
+  return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def summarize(samples, wall_seconds):
+  values = sorted(samples)
+  return {
+    "count": len(values),
+    "mean_ms": round(statistics.fmean(values) * 1000, 3) if values else 0.0,
+    "p50_ms": round(percentile(values, 50) * 1000, 3),
+    "p95_ms": round(percentile(values, 95) * 1000, 3),
+    "p99_ms": round(percentile(values, 99) * 1000, 3),
+    "throughput_per_s": round(len(values) / wall_seconds, 2) if wall_seconds else 0.0,
+  }
+
+
+def make_payload(items_per_receipt):
+  return {
+    "order_id": f"BENCH-{uuid.uuid4().hex[:12]}",
+    "customer_name": "Bench Customer",
+    "customer_email": "bench.customer@example.com",
+    "payment_method": "Card",
+    "business_store": "Bench Store",
+    "items": [
+      {"product_name": f"Item {n}", "quantity": n + 1, "unit_price": 1500.0 + n}
+      for n in range(items_per_receipt)
+    ],
+  }
+
+
+def run_load(main, args):
+  from fastapi.testclient import TestClient
+
+  results = {"endpoints": {}, "stages": {}}
+
+  with TestClient(main.app) as client:
+    recorder.reset() # Throw away the startup seeding commit
+
+    def timed_call(method, url, **kwargs):
+      start = time.perf_counter()
+      response = client.request(method, url, **kwargs)
+      elapsed = time.perf_counter() - start
+      if response.status_code >= 400:
+        raise RuntimeError(f"{method} {url} -> {response.status_code}: {response.text[:200]}")
+      return elapsed, response
+
+    def post_webhook(payload):
+      # Behaves like a well-mannered till: on a 503 (render pool full) it waits Retry-After and sends the same receipt
+      # again (nothing was saved, see the webhook). The latency includes those waits, so backpressure shows up in p95
+      # instead of the rejected calls silently dropping out of the samples.
+      start = time.perf_counter()
+      retries = 0
+      while True:
+        response = client.post("/webhook/payment-success/", json=payload)
+        if response.status_code != 503 or retries >= args.max_retries:
+          break
+        retries += 1
+        time.sleep(float(response.headers.get("Retry-After", "1")))
+      elapsed = time.perf_counter() - start
+      if response.status_code >= 400 and response.status_code != 503:
+        raise RuntimeError(f"POST webhook -> {response.status_code}: {response.text[:200]}")
+      return elapsed, retries, response
+
+    # Webhook: the whole pipeline, this is where the stage timings come from
+    webhook_latencies = []
+    created_ids = []
+    rejected = 0
+    retried = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+      futures = [pool.submit(post_webhook, make_payload(args.items)) for _ in range(args.requests)]
+      for future in futures:
+        elapsed, retries, response = future.result()
+        retried += retries
+        if response.status_code == 503:
+          rejected += 1
+          continue
+        webhook_latencies.append(elapsed)
+        created_ids.append(response.json()["id"])
+    webhook_wall = time.perf_counter() - start
+
+    results["endpoints"]["webhook"] = summarize(webhook_latencies, webhook_wall)
+    results["endpoints"]["webhook"]["retried_503"] = retried
+    results["endpoints"]["webhook"]["rejected_503"] = rejected
+    results["endpoints"]["webhook"]["rejected_pct"] = round(rejected / args.requests * 100, 2) if args.requests else 0.0
+    if retried or rejected:
+      print(
+        f"webhook: {retried} retries after a 503, {rejected}/{args.requests} still rejected after {args.max_retries} retries",
+        file=sys.stderr,
+      )
+    for stage in PIPELINE_STAGES + ["email_send", "email_send_resend"]:
+      results["stages"][stage] = summarize(recorder.samples.get(stage, []), webhook_wall)
+
+    # Read side: list and detail
+    for name, urls in (
+      ("list", ["/receipts"] * max(1, args.requests // 4)),
+      ("detail", [f"/receipts/{created_ids[n % len(created_ids)]}" for n in range(args.requests)]),
+    ):
+      latencies = []
+      start = time.perf_counter()
+      with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for elapsed, _ in pool.map(lambda url: timed_call("GET", url), urls):
+          latencies.append(elapsed)
+      results["endpoints"][name] = summarize(latencies, time.perf_counter() - start)
+
+  return results
+
+
+def time_calls(func, iterations):
+  samples = []
+  start = time.perf_counter()
+  for _ in range(iterations):
+    t0 = time.perf_counter()
+    func()
+    samples.append(time.perf_counter() - t0)
+  return summarize(samples, time.perf_counter() - start)
+
+
+def run_micro(main, args):
+  from schemas import ReceiptCreate
+
+  main.init_db() # A micro-only run never starts the app, and the renderer looks up store branding in the DB
+  receipt = ReceiptCreate(**make_payload(args.items))
+  results = {
+    "compute_totals": time_calls(lambda: main.compute_totals(receipt.items), args.iterations),
+    "receipt_to_html": time_calls(lambda: main.receipt_to_html(receipt), args.iterations),
+  }
+
+  if wkhtmltopdf_available() and args.pdf != "stub":
+    html = main.receipt_to_html(receipt)
+    results["html_to_pdf_bytes"] = time_calls(lambda: main.html_to_pdf_bytes(html), max(1, args.iterations // 100))
+  else:
+    print("wkhtmltopdf not found, skipping html_to_pdf_bytes microbenchmark", file=sys.stderr)
+
+  return results
+
+
+def run_serialization(main, args):
+  # Cost of turning 1k receipts into a JSON body: the old path (ORM objects + jsonable_encoder + json) against the
+  # projection + orjson path the endpoints use now
+  import json
+  from fastapi.encoders import jsonable_encoder
+  from sqlalchemy.orm import selectinload
+  from database_models import OrderReceipt, Item
+  import serializers
+
+  db = main.SessionLocal()
+  try:
+    have = db.query(OrderReceipt).count()
+    if have < 1000:
+      db.add_all([
+        main.make_receipt(
+          order_id=f"SER-{n}", customer_name="Bench Customer", customer_email="bench.customer@example.com",
+          payment_method="Card", business_store="Bench Store",
+          items=[Item(product_name=f"Item {k}", quantity=k + 1, unit_price=1500.0 + k) for k in range(args.items)],
+        )
+        for n in range(1000 - have)
+      ])
+      db.commit()
+
+    def orm_path():
+      receipts = db.query(OrderReceipt).options(selectinload(OrderReceipt.items)).limit(1000).all()
+      json.dumps(jsonable_encoder(receipts))
+      db.expunge_all()
+
+    def projection_path():
+      rows = db.query(*serializers.RECEIPT_COLUMNS).order_by(OrderReceipt.id).limit(1000).all()
+      serializers.dumps(serializers.receipt_rows_to_dicts(db, rows))
+
+    iterations = max(3, args.iterations // 100)
+    return {
+      "orm_jsonable_encoder_per_1k": time_calls(orm_path, iterations),
+      "projection_orjson_per_1k": time_calls(projection_path, iterations),
+    }
+  finally:
+    db.close()
+
+
+def run_pdf_profiles(main, args):
+  # Size of the same receipt under every pdf_service profile, against "standard" (plain wkhtmltopdf output)
+  from schemas import ReceiptCreate
+  import pdf_service
+
+  main.init_db()
+  html = main.receipt_to_html(ReceiptCreate(**make_payload(args.items)))
+  return pdf_service.profile_report(html)
+
+
+def print_pdf_profiles(rows):
+  print("\nPDF profiles")
+  print(f"  {'profile':<30}{'bytes':>10}{'saved':>10}{'saved %':>10}{'ms':>10}")
+  for row in rows:
+    print(f"  {row['profile']:<30}{row['bytes']:>10}{row['saved_bytes']:>10}{row['saved_pct']:>10}{row['render_ms']:>10}")
+
+
+def compare_to_baseline(results, baseline, tolerance, max_rejected_pct=1.0):
+  # Compare p95 of every metric present in both runs. Anything slower than baseline * (1 + tolerance) is a regression.
+  # Calls that were still rejected with 503 after retrying aren't in the latencies, so a change that makes the render
+  # pool turn most traffic away could look fast; the rejection rate is gated on its own (absolute percentage points).
+  regressions = []
+  for name, current in results.get("endpoints", {}).items():
+    if "rejected_pct" not in current:
+      continue
+    allowed_pct = baseline.get("endpoints", {}).get(name, {}).get("rejected_pct", 0.0) + max_rejected_pct
+    if current["rejected_pct"] > allowed_pct:
+      regressions.append(
+        f"endpoints.{name}: {current['rejected_pct']}% rejected with 503 > {round(allowed_pct, 2)}% allowed"
+      )
+  for section in ("endpoints", "stages", "micro", "serialization"):
+    for name, current in results.get(section, {}).items():
+      previous = baseline.get(section, {}).get(name)
+      if not previous or not previous.get("count") or not current.get("count"):
+        continue
+      allowed = previous["p95_ms"] * (1 + tolerance)
+      if current["p95_ms"] > allowed:
+        regressions.append(
+          f"{section}.{name}: p95 {current['p95_ms']}ms > baseline {previous['p95_ms']}ms (+{int(tolerance * 100)}% allowed)"
+        )
+  return regressions
+
+
+def print_table(title, section):
+  print(f"\n{title}")
+  print(f"  {'name':<30}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}{'ops/s':>12}")
+  for name, row in section.items():
+    print(f"  {name:<30}{row['count']:>8}{row['p50_ms']:>12}{row['p95_ms']:>12}{row['p99_ms']:>12}{row['throughput_per_s']:>12}")
+
+
+def main_cli(argv=None):
+  parser = argparse.ArgumentParser(description="ReceiptFlow benchmark suite")
+  parser.add_argument("mode", choices=["load", "micro", "pdf", "all"])
+  parser.add_argument("--requests", type=int, default=100, help="Number of webhook calls in the load run")
+  parser.add_argument("--concurrency", type=int, default=4)
+  parser.add_argument("--items", type=int, default=5, help="Line items per generated receipt")
+  parser.add_argument("--iterations", type=int, default=1000, help="Iterations per microbenchmark")
+  parser.add_argument("--database-url", default=None, help="Defaults to a throwaway SQLite file")
+  parser.add_argument("--upload-latency-ms", type=float, default=50)
+  parser.add_argument("--smtp-latency-ms", type=float, default=20)
+  parser.add_argument("--pdf", choices=["auto", "real", "stub"], default="auto")
+  parser.add_argument("--output", help="Write the JSON results here")
+  parser.add_argument("--baseline", help="Fail (exit 1) if any p95 regressed against this JSON file")
+  parser.add_argument("--save-baseline", help="Write the results as the new baseline")
+  parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p95 slowdown vs baseline (0.25 = 25%%)")
+  parser.add_argument("--max-retries", type=int, default=5, help="Webhook retries after a 503, honouring Retry-After")
+  parser.add_argument(
+    "--max-rejected-pct", type=float, default=1.0,
+    help="Allowed increase in webhooks still rejected with 503 vs baseline, in percentage points",
+  )
+  args = parser.parse_args(argv)
+
+  main = install_stand_ins(
+    database_url=args.database_url,
+    upload_latency=args.upload_latency_ms / 1000,
+    smtp_latency=args.smtp_latency_ms / 1000,
+    pdf_mode=args.pdf,
+  )
+
+  results = {
+    "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "save_baseline")},
+  }
+  if args.mode in ("load", "all"):
+    results.update(run_load(main, args))
+    print_table("Endpoints", results["endpoints"])
+    print_table("Pipeline stages", results["stages"])
+  if args.mode in ("micro", "all"):
+    results["micro"] = run_micro(main, args)
+    print_table("Microbenchmarks", results["micro"])
+    results["serialization"] = run_serialization(main, args)
+    print_table("Serialization (1k receipts)", results["serialization"])
+
+  if args.mode in ("pdf", "all"):
+    if wkhtmltopdf_available() and args.pdf != "stub":
+      results["pdf_profiles"] = run_pdf_profiles(main, args)
+      print_pdf_profiles(results["pdf_profiles"])
+    else:
+      print("wkhtmltopdf not found, skipping the PDF profile size report", file=sys.stderr)
+
+  for path in (args.output, args.save_baseline):
+    if path:
+      with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    regressions = compare_to_baseline(results, baseline, args.tolerance, args.max_rejected_pct)
+    if regressions:
+      print("\n❌ Performance regressions:")
+      for line in regressions:
+        print("  " + line)
+      return 1
+    print("\n✅ No regressions against baseline")
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main_cli())
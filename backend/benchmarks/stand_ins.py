@@ -0,0 +1,163 @@
+# Local stand-ins for the things the receipt pipeline talks to (Postgres, Cloudinary, SMTP, wkhtmltopdf)
+# so the benchmarks can run on a laptop or in CI without any credentials.
+
+import os
+import shutil
+import tempfile
+import time
+import threading
+from collections import defaultdict
+
+
+# Every stage timing lands here as (stage -> list of seconds), the runner turns it into percentiles
+class StageRecorder:
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.samples = defaultdict(list)
+
+  def record(self, stage: str, seconds: float):
+    with self._lock:
+      self.samples[stage].append(seconds)
+
+  def reset(self):
+    with self._lock:
+      self.samples.clear()
+
+  def timed(self, stage: str, func):
+    def wrapper(*args, **kwargs):
+      start = time.perf_counter()
+      try:
+        return func(*args, **kwargs)
+      finally:
+        self.record(stage, time.perf_counter() - start)
+    return wrapper
+
+
+recorder = StageRecorder()
+
+
+# A tiny but valid PDF, used when wkhtmltopdf isn't installed on the machine running the benchmark
+STUB_PDF = (
+  b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+  b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+  b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]>>endobj\n"
+  b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+
+def stub_html_to_pdf_bytes(html_str: str, profile=None) -> bytes:
+  # Top level so the render pool can pickle it over to its worker processes
+  return STUB_PDF
+
+
+def wkhtmltopdf_available() -> bool:
+  return shutil.which("wkhtmltopdf") is not None
+
+
+class FakeSMTP:
+  # Mimics the parts of smtplib.SMTP that email_service uses, and just sleeps instead of talking to a server
+  latency = 0.0
+
+  def __init__(self, host=None, port=None, timeout=None):
+    self.host = host
+    self.port = port
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+  def set_debuglevel(self, level):
+    pass
+
+  def ehlo(self):
+    pass
+
+  def starttls(self):
+    pass
+
+  def login(self, user, password):
+    pass
+
+  def send_message(self, msg):
+    time.sleep(self.latency)
+
+
+def install_stand_ins(database_url=None, upload_latency=0.05, smtp_latency=0.02, pdf_mode="auto"):
+  # This MUST run before "main" is imported, because database.py reads DATABASE_URL at import time
+  if database_url is None:
+    db_dir = tempfile.mkdtemp(prefix="receiptflow-bench-")
+    database_url = f"sqlite:///{os.path.join(db_dir, 'bench.db')}"
+  os.environ["DATABASE_URL"] = database_url
+
+  # Dummy SMTP settings so the email senders don't bail out with "Missing SMTP env vars"
+  for key, value in {
+    "SMTP_HOST": "localhost",
+    "SMTP_PORT": "2525",
+    "SMTP_EMAIL": "bench@receiptflow.local",
+    "SMTP_APP_PASSWORD": "bench",
+    "FROM_EMAIL": "bench@receiptflow.local",
+    "From_EMAIL": "bench@receiptflow.local",
+    "RESEND_SMTP_HOST": "localhost",
+    "RESEND_SMTP_PORT": "2525",
+    "RESEND_API_KEY": "bench",
+    "TENANT_AUTH_REQUIRED": "false", # The load run posts without store API keys
+  }.items():
+    os.environ[key] = value
+
+  import smtplib
+  FakeSMTP.latency = smtp_latency
+  smtplib.SMTP = FakeSMTP
+
+  import main
+  from sqlalchemy.orm import Session
+
+  # Cloudinary stand-in: pretend the upload took "upload_latency" seconds and hand back a fake URL
+  def fake_upload(pdf_bytes: bytes, public_id: str) -> str:
+    time.sleep(upload_latency)
+    return f"https://bench.local/receipts/{public_id}.pdf"
+
+  if pdf_mode == "stub" or (pdf_mode == "auto" and not wkhtmltopdf_available()):
+    main.html_to_pdf_bytes = stub_html_to_pdf_bytes
+    main.render_pool.render_func = stub_html_to_pdf_bytes
+
+  # pdf_render is the whole trip through the render pool (queueing + rendering), as the webhook sees it
+  main.receipt_to_html = recorder.timed("html_render", main.receipt_to_html)
+  main.render_pool.render = recorder.timed("pdf_render", main.render_pool.render)
+  main.upload_pdf_to_cloudinary = recorder.timed("upload", fake_upload)
+  import reissue, upload_retry # Background uploads (reissue, retries of failed/synced receipts) use their own import
+  reissue.upload_pdf_to_cloudinary = upload_retry.upload_pdf_to_cloudinary = fake_upload
+  main.send_receipt_email = recorder.timed("email_send", main.send_receipt_email)
+  main.send_receipt_email_resend = recorder.timed("email_send_resend", main.send_receipt_email_resend)
+
+  # Sessions that know whether a commit is the receipt INSERT or the pdf_url UPDATE
+  # (other commits, like the change feed events of the email senders, aren't pipeline stages and aren't recorded)
+  from database_models import OrderReceipt
+
+  class TimedSession(Session):
+    def flush(self, objects=None):
+      # The webhook flushes before committing (to get the receipt number), so remember the INSERT here
+      if any(isinstance(obj, OrderReceipt) for obj in self.new):
+        self.info["receipt_inserted"] = True
+      return super().flush(objects)
+
+    def commit(self):
+      if self.info.pop("receipt_inserted", False) or any(isinstance(obj, OrderReceipt) for obj in self.new):
+        stage = "db_insert"
+      elif any(isinstance(obj, OrderReceipt) for obj in self.dirty):
+        stage = "db_update"
+      else:
+        return super().commit()
+      start = time.perf_counter()
+      try:
+        return super().commit()
+      finally:
+        recorder.record(stage, time.perf_counter() - start)
+
+  main.SessionLocal.class_ = TimedSession
+
+  # Email enqueue is just handing the job to the fair email scheduler, so time that directly
+  main.email_scheduler.submit = recorder.timed("email_enqueue", main.email_scheduler.submit)
+
+  return main
@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from collections import deque
+from starlette.concurrency import run_in_threadpool
+from database import SessionLocal
+from database_models import ReceiptEvent
+from telemetry import logger
+
+
+# Dashboards subscribe to GET /receipts/changes (Server-Sent Events) instead of re-fetching the whole list.
+#
+# Events are rows in "receipt_events", written in the same transaction as the receipt change, so every uvicorn worker
+# sees every event no matter which worker handled the webhook. One poller per process reads new rows and fans them
+# out to that process's connected dashboards, so the DB cost doesn't grow with the number of open dashboards.
+POLL_SECONDS = float(os.getenv("CHANGE_FEED_POLL_SECONDS", "1.0"))
+HEARTBEAT_SECONDS = 15
+MAX_BACKFILL = 1000 # Clients further behind than this get a "reset" event and should reload the page
+# Postgres hands out ids at INSERT time but transactions can commit out of order, so each poll looks back a few ids
+# to catch late commits, and remembers what it already sent so nothing is delivered twice.
+LOOKBACK_IDS = 100
+# Each receipt writes ~4 events (created, pdf_updated, 2 x delivery). Older ones are only useful to a dashboard that
+# reconnects after a long time, and that one gets a "reset" instead, so they are deleted after this long.
+RETENTION_HOURS = float(os.getenv("CHANGE_FEED_RETENTION_HOURS", "24"))
+PRUNE_SECONDS = 300
+PRUNE_BATCH = 5000
+
+
+def receipt_to_event_dict(receipt) -> dict:
+  return {
+    "id": receipt.id,
+    "order_id": receipt.order_id,
+    "receipt_number": receipt.receipt_number,
+    "customer_name": receipt.customer_name,
+    "customer_email": receipt.customer_email,
+    "business_store": receipt.business_store,
+    "payment_method": receipt.payment_method,
+    "subtotal": receipt.subtotal,
+    "tax": receipt.tax,
+    "total": receipt.total,
+    "pdf_url": receipt.pdf_url,
+    "created_at": receipt.created_at.isoformat() if receipt.created_at else None,
+    "items": [
+      {"id": i.id, "product_name": i.product_name, "quantity": i.quantity, "unit_price": i.unit_price}
+      for i in receipt.items
+    ],
+  }
+
+
+def record_event(db, event_type: str, receipt_id: int, payload: dict):
+  # Only adds to the session, the caller's commit publishes it together with the change itself
+  db.add(ReceiptEvent(receipt_id=receipt_id, event_type=event_type, payload=json.dumps(payload, default=str)))
+
+
+def publish_event(event_type: str, receipt_id: int, payload: dict):
+  # For code that has no session of its own (background email tasks)
+  db = SessionLocal()
+  try:
+    record_event(db, event_type, receipt_id, payload)
+    db.commit()
+  finally:
+    db.close()
+
+
+def format_sse(event_id: int, event_type: str, payload: str) -> str:
+  return f"id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n"
+
+
+def _fetch_events(after_id: int, limit: int):
+  db = SessionLocal()
+  try:
+    rows = (
+      db.query(ReceiptEvent.id, ReceiptEvent.event_type, ReceiptEvent.payload)
+      .filter(ReceiptEvent.id > after_id)
+      .order_by(ReceiptEvent.id)
+      .limit(limit)
+      .all()
+    )
+    return [tuple(row) for row in rows]
+  finally:
+    db.close()
+
+
+def _latest_event_id() -> int:
+  db = SessionLocal()
+  try:
+    row = db.query(ReceiptEvent.id).order_by(ReceiptEvent.id.desc()).first()
+    return row[0] if row else 0
+  finally:
+    db.close()
+
+
+def _event_ids_between(after_id: int, up_to_id: int) -> list[int]:
+  db = SessionLocal()
+  try:
+    rows = db.query(ReceiptEvent.id).filter(ReceiptEvent.id > after_id, ReceiptEvent.id <= up_to_id).all()
+    return [row[0] for row in rows]
+  finally:
+    db.close()
+
+
+def _oldest_event_id() -> Optional[int]:
+  db = SessionLocal()
+  try:
+    row = db.query(ReceiptEvent.id).order_by(ReceiptEvent.id).first()
+    return row[0] if row else None
+  finally:
+    db.close()
+
+
+def prune_events(retention_hours: float = RETENTION_HOURS) -> int:
+  # created_at is indexed, so this only touches the rows being deleted. Deletes in batches to keep the transactions
+  # short. Safe to run from every worker.
+  cutoff = datetime.now(timezone.utc) - timedelta(hours=retention_hours)
+  deleted = 0
+  db = SessionLocal()
+  try:
+    while True:
+      ids = [
+        row[0] for row in
+        db.query(ReceiptEvent.id).filter(ReceiptEvent.created_at < cutoff).order_by(ReceiptEvent.id).limit(PRUNE_BATCH).all()
+      ]
+      if not ids:
+        return deleted
+      deleted += db.query(ReceiptEvent).filter(ReceiptEvent.id.in_(ids)).delete(synchronize_session=False)
+      db.commit()
+      if len(ids) < PRUNE_BATCH:
+        return deleted
+  finally:
+    db.close()
+
+
+class ChangeFeed:
+  def __init__(self):
+    self._subscribers = set()
+    self._overflowed = set() # Subscribers whose queue filled up and that have missed events since
+    self._task = None
+    self._high_water = 0
+    self._recently_sent = deque(maxlen=LOOKBACK_IDS * 4)
+    self._recently_sent_set = set()
+
+  def _remember(self, event_id: int):
+    if len(self._recently_sent) == self._recently_sent.maxlen:
+      self._recently_sent_set.discard(self._recently_sent[0])
+    self._recently_sent.append(event_id)
+    self._recently_sent_set.add(event_id)
+
+  async def start(self):
+    self._high_water = await run_in_threadpool(_latest_event_id)
+    # Everything that already exists is old news. The first poll looks back LOOKBACK_IDS, so without this it would push
+    # the last 100 old events to every dashboard on every deploy (behind ids they already have).
+    for event_id in await run_in_threadpool(_event_ids_between, max(0, self._high_water - LOOKBACK_IDS), self._high_water):
+      self._remember(event_id)
+    self._task = asyncio.create_task(self._poll_forever())
+
+  async def stop(self):
+    if self._task:
+      self._task.cancel()
+      self._task = None
+
+  async def _poll_forever(self):
+    pruned_at = time.monotonic()
+    while True:
+      await asyncio.sleep(POLL_SECONDS)
+      if time.monotonic() - pruned_at > PRUNE_SECONDS:
+        pruned_at = time.monotonic()
+        try:
+          deleted = await run_in_threadpool(prune_events)
+          if deleted:
+            logger.info(f"change feed pruned events deleted={deleted}")
+        except Exception as e:
+          logger.warning(f"change feed prune failed error={e!r}")
+      # Keep polling even with nobody connected (one indexed query), so the first dashboard doesn't get a burst of stale events
+      try:
+        events = await run_in_threadpool(_fetch_events, max(0, self._high_water - LOOKBACK_IDS), MAX_BACKFILL)
+      except Exception as e:
+        logger.warning(f"change feed poll failed error={e!r}")
+        continue
+      for event in events:
+        if event[0] in self._recently_sent_set:
+          continue
+        self._remember(event[0])
+        self._high_water = max(self._high_water, event[0])
+        for queue in list(self._subscribers):
+          if queue.full():
+            self._overflowed.add(queue) # A stuck client shouldn't hold everyone up, stream() sends it a "reset"
+            continue
+          queue.put_nowait(event)
+
+  async def stream(self, last_event_id: Optional[int]):
+    # Subscribe BEFORE backfilling, so nothing committed in between is lost. Duplicates are skipped by id.
+    queue = asyncio.Queue(maxsize=MAX_BACKFILL)
+    self._subscribers.add(queue)
+    backfilled = set()
+    try:
+      yield "retry: 3000\n\n"
+      if last_event_id is not None:
+        backlog = await run_in_threadpool(_fetch_events, last_event_id, MAX_BACKFILL + 1)
+        oldest = await run_in_threadpool(_oldest_event_id)
+        if len(backlog) > MAX_BACKFILL:
+          yield format_sse(backlog[-1][0], "reset", "{}")
+          backlog = []
+        elif oldest is not None and last_event_id < oldest - 1: # What it missed has already been pruned
+          yield format_sse(backlog[-1][0] if backlog else oldest, "reset", "{}")
+          backlog = []
+        for event_id, event_type, payload in backlog:
+          backfilled.add(event_id)
+          yield format_sse(event_id, event_type, payload)
+
+      while True:
+        if queue in self._overflowed:
+          # Events were dropped for this client. It's still connected, so it won't resend Last-Event-ID on its own:
+          # throw away what's queued and tell it to reload, then carry on from the newest event.
+          self._overflowed.discard(queue)
+          while not queue.empty():
+            queue.get_nowait()
+          yield format_sse(self._high_water, "reset", "{}")
+          continue
+        try:
+          event_id, event_type, payload = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+          yield ": heartbeat\n\n" # Keeps proxies/load balancers from closing an idle connection
+          continue
+        if event_id in backfilled: # Only the backfill can overlap, the poller never repeats an event
+          continue
+        yield format_sse(event_id, event_type, payload)
+    finally:
+      self._subscribers.discard(queue)
+      self._overflowed.discard(queue)
+
+
+change_feed = ChangeFeed()
@@ -2,6 +2,7 @@ import cloudinary
 import tempfile # To create Temporary files
 import cloudinary.uploader
 import os
+from telemetry import span
 
 def upload_pdf_to_cloudinary(pdf_bytes: bytes, public_id: str) -> str:
   tmp_path = None
@@ -11,13 +12,14 @@ def upload_pdf_to_cloudinary(pdf_bytes: bytes, public_id: str) -> str:
       tmp.flush()
       tmp_path = tmp.name # Windows File locking while open so setting the value of tmp_path as the tmp name
 
-      result = cloudinary.uploader.upload(
-        tmp_path,
-        resource_type = "raw", # This is used ensure the pdf uploads properly
-        folder="receipts",
-        public_id = public_id,
-        overwrite=True,
-      )
+      with span("cloudinary_api", public_id=public_id):
+        result = cloudinary.uploader.upload(
+          tmp_path,
+          resource_type = "raw", # This is used ensure the pdf uploads properly
+          folder="receipts",
+          public_id = public_id,
+          overwrite=True,
+        )
 
       return result["secure_url"] # This returns the url generated, 
   finally:
@@ -0,0 +1,170 @@
+import os
+import time
+import threading
+from typing import Optional
+from datetime import datetime, timezone
+from sqlalchemy import event, case, or_, func, update
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
+from database_models import OrderReceipt, CustomerSummary, normalize_email
+from serializers import RECEIPT_COLUMNS, receipt_rows_to_dicts
+from email_service import send_receipt_digest_email
+from tenants import usage_tracker
+from telemetry import logger
+
+
+# Customer history: "all my receipts" for one email address. Receipts are found through customer_email_key (the
+# normalised email, indexed together with id) and paged newest first by id, so a page costs the same no matter how
+# many receipts the customer or the table has. Lifetime totals come from customer_summaries, one row per customer
+# and store, which is updated by the flush that inserts the receipt (same transaction, nothing to drift).
+DIGEST_MAX_RECEIPTS = int(os.getenv("DIGEST_MAX_RECEIPTS", "50"))
+# One digest per address and store per cooldown, so a store key can't be used to flood someone's inbox.
+# Kept in each process like the rate limit's token buckets, with N workers an address can get up to N digests.
+DIGEST_COOLDOWN_SECONDS = float(os.getenv("DIGEST_COOLDOWN_SECONDS", "3600"))
+
+_UPSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _as_utc(value: datetime) -> datetime:
+  return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+@event.listens_for(Session, "after_flush")
+def update_customer_summaries(session, flush_context):
+  # Covers every way a receipt gets created (webhook, POS sync, seeding) without each of them having to remember
+  new_receipts = [obj for obj in session.new if isinstance(obj, OrderReceipt)]
+  if not new_receipts:
+    return
+
+  now = datetime.now(timezone.utc)
+  totals = {}
+  for receipt in new_receipts:
+    # created_at is usually a server default that isn't loaded yet (and can't be loaded mid-flush), "now" is close enough
+    at = _as_utc(receipt.__dict__.get("created_at") or now)
+    count, spend, first, last = totals.get((receipt.customer_email_key, receipt.business_store), (0, 0.0, at, at))
+    totals[(receipt.customer_email_key, receipt.business_store)] = (count + 1, spend + receipt.total, min(first, at), max(last, at))
+
+  connection = session.connection()
+  insert = _UPSERTS.get(connection.dialect.name)
+  for (email_key, store), (count, spend, first, last) in totals.items():
+    values = dict(
+      customer_email_key=email_key, business_store=store, order_count=count, total_spend=spend,
+      first_purchase_at=first, last_purchase_at=last,
+    )
+    if insert is None: # Other databases: no portable upsert, UPDATE first and INSERT the first receipt
+      result = connection.execute(
+        update(CustomerSummary)
+        .where(CustomerSummary.customer_email_key == email_key, CustomerSummary.business_store == store)
+        .values(
+          order_count=CustomerSummary.order_count + count,
+          total_spend=CustomerSummary.total_spend + spend,
+          last_purchase_at=last,
+        )
+      )
+      if not result.rowcount:
+        connection.execute(CustomerSummary.__table__.insert().values(**values))
+      continue
+
+    # INSERT ... ON CONFLICT DO UPDATE, so two webhooks for a brand new customer can't trip over each other
+    stmt = insert(CustomerSummary).values(**values)
+    excluded = stmt.excluded
+    connection.execute(stmt.on_conflict_do_update(
+      index_elements=[CustomerSummary.customer_email_key, CustomerSummary.business_store],
+      set_={
+        "order_count": CustomerSummary.order_count + excluded.order_count,
+        "total_spend": CustomerSummary.total_spend + excluded.total_spend,
+        # Synced offline receipts can be older than what we have already
+        "first_purchase_at": case(
+          (or_(CustomerSummary.first_purchase_at.is_(None), excluded.first_purchase_at < CustomerSummary.first_purchase_at), excluded.first_purchase_at),
+          else_=CustomerSummary.first_purchase_at,
+        ),
+        "last_purchase_at": case(
+          (or_(CustomerSummary.last_purchase_at.is_(None), excluded.last_purchase_at > CustomerSummary.last_purchase_at), excluded.last_purchase_at),
+          else_=CustomerSummary.last_purchase_at,
+        ),
+      },
+    ))
+
+
+def customer_summary(db, email_key: str, business_store: Optional[str] = None) -> dict:
+  query = db.query(
+    func.sum(CustomerSummary.order_count),
+    func.sum(CustomerSummary.total_spend),
+    func.min(CustomerSummary.first_purchase_at),
+    func.max(CustomerSummary.last_purchase_at),
+  ).filter(CustomerSummary.customer_email_key == email_key)
+  if business_store:
+    query = query.filter(CustomerSummary.business_store == business_store)
+  order_count, total_spend, first_purchase_at, last_purchase_at = query.one()
+  return {
+    "order_count": order_count or 0,
+    "total_spend": round(total_spend or 0.0, 2),
+    "first_purchase_at": first_purchase_at,
+    "last_purchase_at": last_purchase_at,
+  }
+
+
+def customer_history_page(db, email: str, business_store: Optional[str], limit: int, before_id: Optional[int]) -> dict:
+  email_key = normalize_email(email)
+  query = db.query(*RECEIPT_COLUMNS).filter(OrderReceipt.customer_email_key == email_key)
+  if business_store:
+    query = query.filter(OrderReceipt.business_store == business_store)
+  if before_id is not None:
+    query = query.filter(OrderReceipt.id < before_id)
+  rows = query.order_by(OrderReceipt.id.desc()).limit(limit + 1).all() # One extra row tells us if there's another page
+  receipts = receipt_rows_to_dicts(db, rows[:limit])
+  return {
+    "customer_email": email_key,
+    "summary": customer_summary(db, email_key, business_store),
+    "receipts": receipts,
+    "next_before_id": receipts[-1]["id"] if len(rows) > limit else None,
+  }
+
+
+def digest_receipts(db, email: str, business_store: Optional[str]) -> list[dict]:
+  # The newest receipts that have a PDF, that's all the digest email needs
+  query = (
+    db.query(OrderReceipt.order_id, OrderReceipt.customer_name, OrderReceipt.business_store, OrderReceipt.total,
+             OrderReceipt.pdf_url, OrderReceipt.created_at)
+    .filter(OrderReceipt.customer_email_key == normalize_email(email), OrderReceipt.pdf_url.isnot(None))
+  )
+  if business_store:
+    query = query.filter(OrderReceipt.business_store == business_store)
+  rows = query.order_by(OrderReceipt.id.desc()).limit(DIGEST_MAX_RECEIPTS).all()
+  return [row._asdict() for row in rows]
+
+
+class DigestCooldown:
+  def __init__(self, seconds: float):
+    self.seconds = seconds
+    self._last_sent = {} # (tenant_id, email_key) -> monotonic time of the last digest
+    self._lock = threading.Lock()
+
+  def try_acquire(self, tenant_id: int, email: str):
+    # Returns (allowed, seconds until the address can get another digest)
+    key = (tenant_id, normalize_email(email))
+    with self._lock:
+      now = time.monotonic()
+      if len(self._last_sent) > 10000: # Forget addresses whose cooldown is over, keeps the dict small
+        self._last_sent = {k: at for k, at in self._last_sent.items() if now - at < self.seconds}
+      last = self._last_sent.get(key)
+      if last is not None and now - last < self.seconds:
+        return False, self.seconds - (now - last)
+      self._last_sent[key] = now
+      return True, 0.0
+
+
+digest_cooldown = DigestCooldown(DIGEST_COOLDOWN_SECONDS)
+
+
+def send_customer_digest(tenant, to_email: str, customer_name: str, receipts: list, business_store: Optional[str] = None):
+  # Runs on the email scheduler. Counts as one email against the store's daily quota.
+  if tenant is not None and not usage_tracker.reserve_email(tenant.id, tenant.daily_email_quota):
+    logger.warning(f"digest skipped, email quota reached store={tenant.name} to={to_email}")
+    return
+  try:
+    send_receipt_digest_email(to_email=to_email, customer_name=customer_name, receipts=receipts, business_store=business_store)
+  except Exception:
+    if tenant is not None:
+      usage_tracker.release_email(tenant.id, tenant.daily_email_quota)
+    raise
@@ -1,10 +1,15 @@
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.orm import declarative_base, relationship, validates
 from sqlalchemy.sql import func
-from sqlalchemy import Column, Integer, Float, ForeignKey, String, DateTime
+from sqlalchemy import Column, Integer, Float, ForeignKey, String, DateTime, Text, Boolean, Date, Index
 import uuid
 
 Base = declarative_base()
 
+# "John@Example.com " and "john@example.com" are the same customer
+def normalize_email(email: str) -> str:
+  return email.strip().lower()
+
+
 class OrderReceipt(Base):
   __tablename__ = "order_receipts" # This is my "order_receipts" table
   id = Column(Integer, primary_key=True, autoincrement=True, index=True) # Index = True, tells my table to create an index for faster lookup
@@ -16,6 +21,7 @@ class OrderReceipt(Base):
 
   customer_name = Column(String, nullable=False)
   customer_email = Column(String, nullable=False)
+  customer_email_key = Column(String, nullable=False) # normalize_email(customer_email), kept in sync by the validator below
   business_store = Column(String, nullable=False)
 
   subtotal = Column(Float, nullable=False)
@@ -28,6 +34,9 @@ class OrderReceipt(Base):
   # PDF URL for CLoudinary
   pdf_url = Column(String, nullable=True)
 
+  # The store tenant whose API key created this receipt (NULL for receipts from before tenants existed)
+  tenant_id = Column(Integer, ForeignKey("store_tenants.id"), nullable=True, index=True)
+
 
   items = relationship(
     "Item", # This links it to the db model
@@ -35,6 +44,14 @@ class OrderReceipt(Base):
     cascade="all, delete-orphan"
   )
 
+  # Customer history pages through one customer's receipts newest first, straight off this index
+  __table_args__ = (Index("ix_order_receipts_customer_email_key_id", "customer_email_key", "id"),)
+
+  @validates("customer_email")
+  def _set_customer_email_key(self, key, value):
+    self.customer_email_key = normalize_email(value)
+    return value
+
 
 
 
@@ -57,3 +74,105 @@ class Item(Base):
 
     # cascade="all, delete-orphan" we can't use the cascade on the child table, because that would mean it is very possible to delete an item, which in turn would delete the parent table(the order receipt)
   )
+
+
+
+# Change feed for the dashboards. Rows are written in the SAME transaction as the change they describe,
+# and the SSE endpoint streams them out in id order (the id doubles as the SSE "Last-Event-ID")
+class ReceiptEvent(Base):
+  __tablename__ = "receipt_events"
+  id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+  receipt_id = Column(Integer, ForeignKey("order_receipts.id", ondelete="CASCADE"), nullable=False, index=True)
+
+  event_type = Column(String, nullable=False) # receipt.created / receipt.pdf_updated / receipt.delivery
+  payload = Column(Text, nullable=False) # Already JSON encoded, so streaming it out is just string formatting
+  created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True) # For pruning
+
+
+
+# A store using ReceiptFlow. Its API key authenticates its webhook calls, and its limits keep one store's burst
+# from stalling everyone else's receipts
+class StoreTenant(Base):
+  __tablename__ = "store_tenants"
+  id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+  name = Column(String, nullable=False, unique=True) # This is what ends up in OrderReceipt.business_store
+
+  api_key_hash = Column(String, nullable=False, unique=True, index=True) # sha256 of the key, the key itself is never stored
+
+  rate_per_second = Column(Float, nullable=False, default=5.0) # Token bucket refill rate for webhook calls
+  burst = Column(Integer, nullable=False, default=20) # Token bucket size
+  daily_email_quota = Column(Integer, nullable=True) # NULL = unlimited
+
+  active = Column(Boolean, nullable=False, default=True)
+  created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+# Per tenant, per day usage. Counted in memory and flushed here every few seconds (see tenants.py)
+class TenantUsage(Base):
+  __tablename__ = "tenant_usage"
+  tenant_id = Column(Integer, ForeignKey("store_tenants.id", ondelete="CASCADE"), primary_key=True)
+  day = Column(Date, primary_key=True)
+
+  receipts = Column(Integer, nullable=False, default=0)
+  renders = Column(Integer, nullable=False, default=0)
+  emails = Column(Integer, nullable=False, default=0)
+  rate_limited = Column(Integer, nullable=False, default=0)
+
+
+
+# Per store look of the receipt PDF, keyed by business_store so it also covers stores without an API key.
+# Every change bumps "version", that's how each worker notices its precompiled header/footer is stale.
+class StoreBranding(Base):
+  __tablename__ = "store_brandings"
+  business_store = Column(String, primary_key=True)
+  theme = Column(String, nullable=False, default="classic") # Folder under templates/receipts/
+
+  # NULL text/colour columns fall back to the default ReceiptFlow look (receipt_renderer.DEFAULT_BRANDING)
+  brand_name = Column(String, nullable=True)
+  branding_text = Column(String, nullable=True)
+  watermark_text = Column(String, nullable=True)
+  footer_text = Column(String, nullable=True)
+  primary_color = Column(String, nullable=True)
+  primary_dark_color = Column(String, nullable=True)
+  accent_color = Column(String, nullable=True)
+
+  version = Column(Integer, nullable=False, default=1)
+  updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+
+# Receipts whose PDF upload failed. upload_retry.py retries them with backoff, and after UPLOAD_RETRY_MAX_ATTEMPTS
+# the row is marked "dead" (the dead letter queue) and waits for an admin to look at it.
+class UploadFailure(Base):
+  __tablename__ = "upload_failures"
+  receipt_id = Column(Integer, ForeignKey("order_receipts.id", ondelete="CASCADE"), primary_key=True)
+  status = Column(String, nullable=False, default="retrying") # retrying / dead
+  attempts = Column(Integer, nullable=False, default=0)
+  last_error = Column(Text, nullable=True)
+  next_attempt_at = Column(DateTime(timezone=True), nullable=False, index=True)
+  created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+  updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+
+# Offline POS sync (pos_sync.py): the highest client sequence number committed per store device. Clients resend
+# everything after it, anything at or below it is skipped, which is what makes re-sending a batch harmless.
+class SyncCursor(Base):
+  __tablename__ = "sync_cursors"
+  tenant_id = Column(Integer, ForeignKey("store_tenants.id", ondelete="CASCADE"), primary_key=True)
+  device_id = Column(String, primary_key=True)
+  last_seq = Column(Integer, nullable=False, default=0)
+  updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+
+# Lifetime totals per customer and store, updated in the same transaction as every new receipt (see customers.py),
+# so the history endpoint never has to aggregate over order_receipts
+class CustomerSummary(Base):
+  __tablename__ = "customer_summaries"
+  customer_email_key = Column(String, primary_key=True)
+  business_store = Column(String, primary_key=True)
+  order_count = Column(Integer, nullable=False, default=0)
+  total_spend = Column(Float, nullable=False, default=0.0)
+  first_purchase_at = Column(DateTime(timezone=True), nullable=True)
+  last_purchase_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,74 @@
+import os
+import threading
+from collections import OrderedDict, deque
+from telemetry import logger
+
+
+# Receipt emails used to be FastAPI BackgroundTasks, i.e. sent by whichever request thread handled the webhook, in
+# arrival order. Now they go through one queue per store tenant, and a small pool of sender threads takes one job from
+# each tenant in turn (round robin), so a store that just queued 5,000 emails can't push everyone else's to the back.
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "4"))
+
+
+class FairEmailScheduler:
+  def __init__(self, workers: int = EMAIL_WORKERS):
+    self.workers = workers
+    self._queues = OrderedDict() # tenant key -> deque of jobs, in round robin order
+    self._cond = threading.Condition()
+    self._threads = []
+    self._stopping = False
+
+  def submit(self, tenant_key, func, *args, **kwargs):
+    with self._cond:
+      queue = self._queues.get(tenant_key)
+      if queue is None:
+        queue = self._queues[tenant_key] = deque()
+      queue.append((func, args, kwargs))
+      self._cond.notify()
+
+  def pending(self) -> int:
+    with self._cond:
+      return sum(len(q) for q in self._queues.values())
+
+  def _next_job(self):
+    # Call with the lock held. Take the first tenant's oldest job, then send that tenant to the back of the line
+    tenant_key, queue = next(iter(self._queues.items()))
+    job = queue.popleft()
+    if queue:
+      self._queues.move_to_end(tenant_key)
+    else:
+      del self._queues[tenant_key]
+    return job
+
+  def _run(self):
+    while True:
+      with self._cond:
+        while not self._queues and not self._stopping:
+          self._cond.wait()
+        if not self._queues: # Stopping and nothing left to send
+          return
+        func, args, kwargs = self._next_job()
+      try:
+        func(*args, **kwargs)
+      except Exception as e:
+        logger.warning(f"email job failed error={e!r}") # The senders already report through their spans/change feed
+
+  def start(self):
+    with self._cond:
+      self._stopping = False
+    self._threads = [
+      threading.Thread(target=self._run, name=f"email-sender-{n}", daemon=True) for n in range(self.workers)
+    ]
+    for thread in self._threads:
+      thread.start()
+
+  def stop(self, timeout: float = 30):
+    # Lets the queued emails drain (up to "timeout") before the process exits
+    with self._cond:
+      self._stopping = True
+      self._cond.notify_all()
+    for thread in self._threads:
+      thread.join(timeout=timeout)
+
+
+email_scheduler = FairEmailScheduler()
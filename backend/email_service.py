@@ -3,12 +3,16 @@ import smtplib
 from email.message import EmailMessage
 from dotenv import load_dotenv
 from typing import Dict, Any
+from telemetry import span
 # import resend - I'm not using the SDK, but I will be using the SMTP Relay, so I don't need to import the resend package
 
 
 
 load_dotenv()
 
+# SMTP wire transcripts are very noisy (and slow under load), only turn them on when debugging a provider
+SMTP_DEBUG = int(os.getenv("SMTP_DEBUG", "0"))
+
 
 # This function will be called in the webhook using "Background Tasks"
 def send_receipt_email(
@@ -42,19 +46,15 @@ def send_receipt_email(
      f"Regards, \nReceiptFlow"
   )
 
-  try: # Using a try catch block to catch any errors that might occur during the SMTP process, and also to print out the error for debugging purposes.
+  # The span logs the failure (and counts it in /metrics), then we re-raise so the background task still fails loudly
+  with span("smtp", provider="smtp", order_id=order_id, store=business_store):
     with smtplib.SMTP(smtp_host, smtp_port, timeout=20) as server:
-       server.set_debuglevel(1)  # Enable debug output
+       server.set_debuglevel(SMTP_DEBUG)
        server.ehlo() # This Introduces our Program to Gmail's Server "Hello Server"
        server.starttls() # This Turns the connection into an encrypted (secure) connection
        server.ehlo()
        server.login(smtp_email, smtp_password)
        server.send_message(msg)
-       print("SMTP CONFIG:", smtp_host, smtp_port)
-       print(f"✅ Email sent successfully to {to_email}")
-  except Exception as e:
-       print(f" ❌ Email failed: {e}")
-       raise
 
 
 
@@ -77,7 +77,7 @@ def send_receipt_email_resend(
    from_email = os.getenv("From_EMAIL") # This is still my email, but a representation for "ReceiptFlow"
    if not all([resend_smtp_host, resend_smtp_port, resend_api_key, from_email]):
       raise RuntimeError("Missing Resend SMTP env vars (RESEND_SMTP_HOST/RESEND_SMTP_PORT/RESEND_API_KEY)")
-   try:
+   with span("smtp", provider="resend", order_id=order_id, store=business_store):
       msg = EmailMessage()
       msg["Subject"] = f"Your receipt for order {order_id}"
       msg["From"] = from_email
@@ -91,14 +91,54 @@ def send_receipt_email_resend(
       )
 
       with smtplib.SMTP(resend_smtp_host, int(resend_smtp_port), timeout=20) as server:
-         server.set_debuglevel(1)
+         server.set_debuglevel(SMTP_DEBUG)
          server.ehlo()
          server.starttls()
          server.ehlo()
          server.login("resend", resend_api_key) # Resend uses "resend" as the username for SMTP authentication, and the API key as the password.
          server.send_message(msg)
-         print("Resend SMTP CONFIG:", resend_smtp_host, resend_smtp_port)
-         print(f"✅ Resend Email sent successfully to {to_email}")  
-   except Exception as e:
-      print(f" ❌ Resend Email failed: {e}")
-      raise
\ No newline at end of file
+
+
+
+
+
+# CUSTOMER DIGEST: one email listing a customer's receipts (POST /customers/{email}/digest), sent through the main SMTP provider
+def send_receipt_digest_email(
+      to_email: str,
+      customer_name: str,
+      receipts: list,
+      business_store: str = None):
+  smtp_host = os.getenv("SMTP_HOST")
+  smtp_email = os.getenv("SMTP_EMAIL")
+  smtp_password = os.getenv("SMTP_APP_PASSWORD")
+  smtp_port = os.getenv("SMTP_PORT")
+  from_email = os.getenv("FROM_EMAIL")
+
+  if not all([smtp_host, smtp_port, smtp_password, smtp_email, from_email]):
+      raise RuntimeError("Missing SMTP env vars (SMTP_HOST/SMTP_PORT/SMTP_PASS/SMTP_EMAIL)")
+
+  smtp_password = smtp_password.replace(" ", "")
+
+  lines = [
+     f"- {r['created_at']:%Y-%m-%d} | {r['business_store']} | order {r['order_id']} | {r['total']:.2f}\n  {r['pdf_url']}"
+     for r in receipts
+  ]
+  msg = EmailMessage()
+  msg["Subject"] = f"Your receipts from {business_store}" if business_store else "Your receipts"
+  msg["From"] = from_email
+  msg["To"] = to_email
+  msg.set_content(
+     f"Hi {customer_name}, \n\n"
+     f"Here are your {len(receipts)} most recent receipts: \n\n"
+     + "\n".join(lines) +
+     f" \n\nRegards, \nReceiptFlow"
+  )
+
+  with span("smtp", provider="smtp", kind="digest", store=business_store):
+    with smtplib.SMTP(smtp_host, smtp_port, timeout=20) as server:
+       server.set_debuglevel(SMTP_DEBUG)
+       server.ehlo()
+       server.starttls()
+       server.ehlo()
+       server.login(smtp_email, smtp_password)
+       server.send_message(msg)
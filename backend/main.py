@@ -1,10 +1,12 @@
-from fastapi import FastAPI, HTTPException, UploadFile, Depends, BackgroundTasks
-from schemas import ReceiptCreate, PaymentMethod, ReceiptItemResponse
+from fastapi import FastAPI, HTTPException, UploadFile, Depends, BackgroundTasks, Query, Header, Request
+from schemas import ReceiptCreate, PaymentMethod, ReceiptItemResponse, ReceiptResponse, ReissueRequest, TenantCreate, StoreBrandingUpdate, SyncReceipt
 from pathlib import Path
 # from weasyprint import HTML not working
-from jinja2 import Environment, select_autoescape, FileSystemLoader
-from fastapi.responses import Response
-import pdfkit # Using PDFKit since WeasyPrint refuses to work on my windows
+from fastapi.responses import Response, PlainTextResponse, StreamingResponse, JSONResponse
+from typing import Optional, List
+from receipt_renderer import receipt_to_html, template_registry, available_themes
+from pdf_service import html_to_pdf_bytes
+from render_pool import render_pool, RenderQueueFull
 import database_models
 from database_models import OrderReceipt, Item # This is used for seeding
 from database import engine, SessionLocal
@@ -12,9 +14,26 @@ from sqlalchemy.orm import Session
 from cloudinary_service import upload_pdf_to_cloudinary
 from email_service import send_receipt_email, send_receipt_email_resend
 from fastapi.middleware.cors import CORSMiddleware
-
-
-app = FastAPI()
+from telemetry import span, start_trace, tag_trace, render_prometheus, RECEIPTS
+from auth import require_admin
+from change_feed import change_feed, record_event, publish_event, receipt_to_event_dict
+from serializers import RECEIPT_COLUMNS, receipt_rows_to_dicts, json_response, FastJSONResponse
+from tenants import Tenant, require_tenant, authenticate_tenant, usage_tracker, tenant_registry, hash_api_key, generate_api_key
+from email_scheduler import email_scheduler
+from upload_retry import upload_retrier, pdf_cache, record_upload_failure, mark_upload_pending, clear_upload_pending
+from pos_sync import ingest_stream, SyncPayloadError, get_cursor as get_sync_cursor_seq
+from customers import customer_history_page, digest_receipts, send_customer_digest, digest_cooldown
+from database_models import StoreTenant, TenantUsage, StoreBranding, UploadFailure
+from reissue import reissue_receipts, load_checkpoint, filters_key, acquire_checkpoint_lock, release_checkpoint_lock
+import os
+import json
+import math
+import uuid
+import tempfile
+from datetime import datetime, timezone
+
+
+app = FastAPI(default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -125,6 +144,25 @@ def get_db_session():
 
 
 
+@app.on_event("shutdown")
+def stop_render_pool():
+  render_pool.shutdown()
+
+
+@app.on_event("startup")
+def start_background_workers():
+  email_scheduler.start()
+  usage_tracker.start()
+  upload_retrier.start()
+
+
+@app.on_event("shutdown")
+def stop_background_workers():
+  upload_retrier.stop()
+  email_scheduler.stop() # Drain queued emails first, they add to the usage counters
+  usage_tracker.stop()
+
+
 # Creating Db_seed 
 @app.on_event("startup")
 def init_db():
@@ -156,6 +194,17 @@ def init_db():
     db.commit()
   finally:
     db.close()
+
+
+# After init_db, since the feed reads receipt_events on start
+@app.on_event("startup")
+async def start_change_feed():
+  await change_feed.start()
+
+
+@app.on_event("shutdown")
+async def stop_change_feed():
+  await change_feed.stop()
     
 
 
@@ -163,12 +212,21 @@ def init_db():
 
 
 
-@app.get("/receipts")
-def get_reciepts(db: Session = Depends(get_db_session)):
-  db_receipts = db.query(OrderReceipt).all()
+# "limit" + "before_id" page through receipts newest first, so dashboards can load one page and then follow /receipts/changes
+# The response is built from column tuples by serializers.py (no ORM objects, no jsonable_encoder), response_model is for the docs
+@app.get("/receipts", response_model=List[ReceiptResponse])
+def get_reciepts(request: Request, limit: Optional[int] = Query(default=None, ge=1, le=500), before_id: Optional[int] = None, db: Session = Depends(get_db_session)):
+  query = db.query(*RECEIPT_COLUMNS)
+  if before_id is not None:
+    query = query.filter(OrderReceipt.id < before_id)
+  if limit is not None:
+    query = query.order_by(OrderReceipt.id.desc()).limit(limit)
+  else:
+    query = query.order_by(OrderReceipt.id)
+  db_receipts = receipt_rows_to_dicts(db, query.all())
   if not db_receipts:
     raise HTTPException(status_code=400, detail="No Order Receipts Found in the db")
-  return db_receipts
+  return json_response(request, db_receipts)
   
 
 
@@ -181,60 +239,98 @@ def get_reciepts(db: Session = Depends(get_db_session)):
 #   return HTTPException(status_code=200, detail=f"{receipt.customer_name} receipt Created!")
 
 
-@app.get("/receipts/{receipt_id}")
-def get_receipt_by_id(receipt_id: int, db: Session):
-  receipt = db.query(OrderReceipt).filter(OrderReceipt.id == receipt_id).first()
+# Server-Sent Events feed of receipt changes (receipt.created / receipt.pdf_updated / receipt.delivery).
+# Browsers resend the last id they saw in the Last-Event-ID header when they reconnect, "last_event_id" does the same by hand.
+# Declared before /receipts/{receipt_id} so "changes" isn't parsed as an id.
+@app.get("/receipts/changes")
+async def receipt_changes(last_event_id: Optional[int] = None, last_event_id_header: Optional[str] = Header(default=None, alias="Last-Event-ID")):
+  if last_event_id is None and last_event_id_header and last_event_id_header.isdigit():
+    last_event_id = int(last_event_id_header)
+  return StreamingResponse(
+    change_feed.stream(last_event_id),
+    media_type="text/event-stream",
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, # No proxy buffering, events must go out immediately
+  )
+
+
+@app.get("/receipts/{receipt_id}", response_model=ReceiptResponse)
+def get_receipt_by_id(request: Request, receipt_id: int, db: Session = Depends(get_db_session)):
+  receipt = receipt_rows_to_dicts(db, db.query(*RECEIPT_COLUMNS).filter(OrderReceipt.id == receipt_id).all())
   if not receipt:
     raise HTTPException(status_code=404, detail=f"Receipt with ID {receipt_id} not found")
-  return receipt
+  return json_response(request, receipt[0])
 
 
 
-# Loading the "templates" folder
-env = Environment(
-  loader=FileSystemLoader("templates"),
-  autoescape=select_autoescape(["html", "xml"]),
-)
+# Prometheus scrape endpoint, the stage histograms are filled in by the spans in the webhook and services
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+  return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
 
 
-# This is where the heavy work of turning receipt to Html occurs
-def receipt_to_html(data: ReceiptCreate):
-  template = env.get_template("receipt.html")
-  subtotal = sum(i.quantity* i.unit_price for i in data.items) # Calculating the Subtotal
-  tax = subtotal * 0.10
-  total = subtotal + tax
-  payment_method = (
-    data.payment_method.value
-    if hasattr(data.payment_method, "value")
-    else data.payment_method
-  ) # Using this, just in case the db messes up the value of the Enum
 
-  business_store= data.business_store
+# Runs the email sender and puts the outcome on the change feed, so dashboards can show delivery status
+def send_and_report_delivery(sender, provider: str, receipt_id: int, tenant: Optional[Tenant] = None, **email_kwargs):
+  if tenant is not None and not usage_tracker.reserve_email(tenant.id, tenant.daily_email_quota):
+    publish_event("receipt.delivery", receipt_id, {"id": receipt_id, "provider": provider, "status": "quota_exceeded"})
+    return
+  try:
+    sender(**email_kwargs)
+  except Exception as e:
+    if tenant is not None: # Failed sends don't count against the quota
+      usage_tracker.release_email(tenant.id, tenant.daily_email_quota)
+    publish_event("receipt.delivery", receipt_id, {"id": receipt_id, "provider": provider, "status": "failed", "error": str(e)})
+    raise
+  publish_event("receipt.delivery", receipt_id, {"id": receipt_id, "provider": provider, "status": "sent"})
 
 
-  # Declaring the variables
-  return template.render(
-    receipt=data, 
-    total=total,
-    subtotal=subtotal,
-    tax=tax,
-    items = data.items,
-    payment_method = payment_method,
-    business_store = business_store
-    )
+# Send Email in Background(So it won't block the process). The scheduler takes turns between stores, see email_scheduler.py
+def enqueue_receipt_emails(db_receipt: OrderReceipt, tenant: Optional[Tenant] = None):
+  email_kwargs = dict(
+    to_email=db_receipt.customer_email,
+    customer_name=db_receipt.customer_name,
+    pdf_url=db_receipt.pdf_url,
+    business_store = db_receipt.business_store,
+    order_id = db_receipt.order_id
+  )
+  tenant_key = tenant.id if tenant else None
+  email_scheduler.submit(tenant_key, send_and_report_delivery, send_receipt_email, "smtp", db_receipt.id, tenant=tenant, **email_kwargs)
+
+  # RESEND
+  # Resend email task, in case the first one fails, this will be retried by Resend's retry mechanism, and also it will be useful for the resend email feature in the frontend.
+  email_scheduler.submit(tenant_key, send_and_report_delivery, send_receipt_email_resend, "resend", db_receipt.id, tenant=tenant, **email_kwargs)
+
 
+# A PDF that only got uploaded by the retry sweep still owes the customer their emails
+def send_emails_after_retry(db_receipt: OrderReceipt):
+  enqueue_receipt_emails(db_receipt, tenant_registry.get_by_id(db_receipt.tenant_id))
 
-def html_to_pdf_bytes(html_str: str) -> bytes:
-  return pdfkit.from_string(html_str, False)
-  # return HTML(string=html_str).write_pdf() weasyprint not working on my PC, lol, maybe because it's a C library pkg
+
+upload_retrier.on_uploaded = send_emails_after_retry
+
+
+# The receipt is saved but its PDF isn't uploaded yet, the retry sweep takes it from here
+def upload_retrying_response(db_receipt: OrderReceipt) -> JSONResponse:
+  return JSONResponse(status_code=202, content={
+    "id": db_receipt.id,
+    "order_id": db_receipt.order_id,
+    "receipt_number": db_receipt.receipt_number,
+    "Pdf_Url": None,
+    "upload_status": "retrying",
+  })
 
 
 # Webhook Payment Success
 @app.post("/webhook/payment-success/")
-def order_webhook(receipt: ReceiptCreate, background_tasks: BackgroundTasks,db: Session = Depends(get_db_session)):
+def order_webhook(receipt: ReceiptCreate, db: Session = Depends(get_db_session), tenant: Optional[Tenant] = Depends(require_tenant)):
+  # With an API key the store is whoever owns the key, a tenant can't file receipts under another store's name
+  business_store = tenant.name if tenant else receipt.business_store
+  tenant_key = tenant.id if tenant else None # Keyless callers share one fair-share slot group
+  start_trace(order_id=receipt.order_id, store=business_store)
   receipt_exists = db.query(OrderReceipt).filter(OrderReceipt.order_id == receipt.order_id).first()
 
   if receipt_exists:
+    RECEIPTS.inc("duplicate")
     raise HTTPException(status_code=409, detail="Order Receipt Already Exists, can't add new Receipt")
   
   # We need to compute total and the likes for the receipt data
@@ -252,7 +348,8 @@ def order_webhook(receipt: ReceiptCreate, background_tasks: BackgroundTasks,db:
     subtotal=subtotal,
     tax=tax,
     total=total,
-    business_store=receipt.business_store,
+    business_store=business_store,
+    tenant_id=tenant.id if tenant else None,
     items = [
       Item(
         product_name = i.product_name, 
@@ -263,61 +360,69 @@ def order_webhook(receipt: ReceiptCreate, background_tasks: BackgroundTasks,db:
     ]
   )
 
-  # Finally we can save it - Moved This down here so incase the generation and smtp don't work we can easily be sure that the data was not saved
-  db.add(db_receipt)
-  db.commit()
-  db.refresh(db_receipt)
-  print("STEP 1: saved to DB", db_receipt.id)
+  # Take a render slot BEFORE saving anything, if the render pool is already backed up we fail fast and nothing is written
+  try:
+    render_slot = render_pool.admit(tenant_key)
+  except RenderQueueFull as e:
+    RECEIPTS.inc("render_rejected")
+    raise HTTPException(
+      status_code=503,
+      detail="Receipt rendering is at capacity, please retry",
+      headers={"Retry-After": str(e.retry_after)},
+    )
 
-  # Now i can Generate the PDF Using PDFKIT and Jinja2
-  html = receipt_to_html(db_receipt)
-  print("STEP 2: html ready", len(html)) # Chnaging the validated receipt data to html
-  pdf_bytes = html_to_pdf_bytes(html)
-  print("STEP 3: pdf bytes ready", len(pdf_bytes))
+  with render_slot:
+    # Finally we can save it - Moved This down here so incase the generation and smtp don't work we can easily be sure that the data was not saved
+    with span("db_insert"):
+      db.add(db_receipt)
+      db.flush()
+      db.refresh(db_receipt) # Picks up receipt_number/created_at for the change feed event, inside the same transaction
+      record_event(db, "receipt.created", db_receipt.id, receipt_to_event_dict(db_receipt))
+      mark_upload_pending(db, db_receipt.id) # Cleared with the pdf_url, the retry sweep picks it up if we never get there
+      db.commit()
+    tag_trace(receipt_number=db_receipt.receipt_number, receipt_id=db_receipt.id)
+    usage_tracker.incr(tenant_key, "receipts")
+
+    # Now i can Generate the PDF Using PDFKIT and Jinja2
+    try:
+      with span("html_render"):
+        html = receipt_to_html(db_receipt) # Chnaging the validated receipt data to html
+      with span("pdf_render"):
+        pdf_bytes = render_pool.render(html) # Runs in the process pool, this thread just waits for the bytes
+    except Exception as e:
+      # Same as a failed upload below: the receipt is saved, so hand it to the retry sweep (which renders it again)
+      # rather than a 500 that the caller would retry into the 409
+      RECEIPTS.inc("render_failed")
+      record_upload_failure(db, db_receipt.id, repr(e))
+      db.commit()
+      return upload_retrying_response(db_receipt)
+    usage_tracker.incr(tenant_key, "renders")
 
   # Cloudinary Upload
   public_id = f"{db_receipt.order_id}-{db_receipt.receipt_number}" # This creates the public id 
-   # Cloudinary Upload
-  public_id = f"{db_receipt.order_id}-{db_receipt.receipt_number}"
 
-  try: # This Try catch block is to catch any errors that might occur during the cloudinary upload process, and also to print out the error for debugging purposes on Railway.
-    print("STEP 4: starting cloudinary upload", public_id, len(pdf_bytes))
-    pdf_url = upload_pdf_to_cloudinary(pdf_bytes, public_id=public_id)
-    print("STEP 5: cloudinary ok", pdf_url)
+  try: # The upload span already logs the error (with the receipt tags)
+    with span("upload", size_bytes=len(pdf_bytes)):
+      pdf_url = upload_pdf_to_cloudinary(pdf_bytes, public_id=public_id)
   except Exception as e:
-    print("STEP 4 FAILED: cloudinary error:", repr(e))
-    raise HTTPException(status_code=502, detail="Cloudinary upload failed")
-
-  db_receipt.pdf_url = pdf_url
-  db.commit()
-  db.refresh(db_receipt)
-  print(" ✅ STEP 6: Receipt URL Saved Successfully on DB", pdf_url)
-
-  # Send Email in Background(So it won't block the process)
+    # The receipt is saved, so a 502 would only make the caller retry into the 409. Keep the PDF and let the
+    # retry sweep (upload_retry.py) upload it and send the emails later.
+    RECEIPTS.inc("upload_failed")
+    pdf_cache.put(db_receipt.receipt_number, pdf_bytes)
+    record_upload_failure(db, db_receipt.id, repr(e))
+    db.commit()
+    return upload_retrying_response(db_receipt)
 
-  print("STEP 7: Starting Email SMTP", db_receipt.customer_email, pdf_url) # This is to check if the email and pdf url are correct before sending the email, and also to check if the process is reaching this point.
-  background_tasks.add_task(
-    send_receipt_email,
-    to_email=db_receipt.customer_email,
-    customer_name=db_receipt.customer_name,
-    pdf_url=pdf_url,
-    business_store = db_receipt.business_store,
-    order_id = db_receipt.order_id
-  )
+  with span("db_update"):
+    db_receipt.pdf_url = pdf_url
+    record_event(db, "receipt.pdf_updated", db_receipt.id, {"id": db_receipt.id, "pdf_url": pdf_url})
+    clear_upload_pending(db, db_receipt.id)
+    db.commit()
+    db.refresh(db_receipt)
 
-  # RESEND
-  print("STEP 8: Starting Resend Email SMTP", db_receipt.customer_email, pdf_url)
-  try:
-    background_tasks.add_task( # Resend email task, in case the first one fails, this will be retried by Resend's retry mechanism, and also it will be useful for the resend email feature in the frontend.
-      send_receipt_email_resend,
-      to_email=db_receipt.customer_email,
-      customer_name=db_receipt.customer_name,
-      pdf_url=pdf_url,
-      business_store = db_receipt.business_store,
-      order_id = db_receipt.order_id
-    )
-  except Exception as e:
-    print("Failed to add Resend email task:", repr(e))
+  with span("email_enqueue"):
+    enqueue_receipt_emails(db_receipt, tenant)
+  RECEIPTS.inc("created")
 
 
   # MIGRATING FROM STREAMLINE DOWNLOAD TO UPLOADING ON CLOUDINARY
@@ -339,3 +444,259 @@ def order_webhook(receipt: ReceiptCreate, background_tasks: BackgroundTasks,db:
   }
 
 
+
+# Customer history: one customer's receipts (newest first, paged by id) and their lifetime totals, see customers.py.
+# Both need a store API key and only see that store's receipts.
+@app.get("/customers/{email}/receipts")
+def get_customer_receipts(
+    email: str,
+    request: Request,
+    limit: int = Query(default=20, ge=1, le=100),
+    before_id: Optional[int] = Query(default=None, ge=1),
+    db: Session = Depends(get_db_session),
+    tenant: Optional[Tenant] = Depends(authenticate_tenant)):
+  if tenant is None:
+    raise HTTPException(status_code=401, detail="Customer history needs the store's X-API-Key")
+  page = customer_history_page(db, email, tenant.name, limit, before_id)
+  if not page["receipts"] and before_id is None:
+    raise HTTPException(status_code=404, detail=f"No receipts for {page['customer_email']}")
+  return json_response(request, page)
+
+
+@app.post("/customers/{email}/digest", status_code=202)
+def send_customer_receipt_digest(email: str, db: Session = Depends(get_db_session), tenant: Optional[Tenant] = Depends(require_tenant)):
+  if tenant is None:
+    raise HTTPException(status_code=401, detail="Sending a digest needs the store's X-API-Key")
+  store = tenant.name
+  receipts = digest_receipts(db, email, store)
+  if not receipts:
+    raise HTTPException(status_code=404, detail=f"No receipts with a PDF for {email}")
+  allowed, retry_after = digest_cooldown.try_acquire(tenant.id, email)
+  if not allowed:
+    raise HTTPException(
+      status_code=429,
+      detail=f"A digest was already sent to {email} recently",
+      headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+  email_scheduler.submit(
+    tenant.id,
+    send_customer_digest,
+    tenant,
+    to_email=email,
+    customer_name=receipts[0]["customer_name"],
+    receipts=receipts,
+    business_store=store,
+  )
+  return {"customer_email": email, "receipts": len(receipts), "status": "queued"}
+
+
+# Offline POS sync: a till uploads its whole offline backlog as one compressed NDJSON stream, see pos_sync.py
+def build_synced_receipt(record: SyncReceipt, tenant: Tenant) -> OrderReceipt:
+  db_receipt = make_receipt(
+    order_id=record.order_id,
+    customer_name=record.customer_name,
+    customer_email=str(record.customer_email),
+    payment_method=record.payment_method.value,
+    business_store=tenant.name,
+    items=[Item(product_name=i.product_name, quantity=i.quantity, unit_price=i.unit_price) for i in record.items],
+  )
+  db_receipt.tenant_id = tenant.id
+  db_receipt.created_at = record.sold_at or datetime.now(timezone.utc)
+  return db_receipt
+
+
+@app.post("/sync/receipts")
+async def sync_receipts(request: Request, x_device_id: str = Header(min_length=1, max_length=100), tenant: Optional[Tenant] = Depends(require_tenant)):
+  if tenant is None:
+    raise HTTPException(status_code=401, detail="Syncing needs the store's X-API-Key")
+  try:
+    result = await ingest_stream(request.stream(), request.headers.get("content-encoding"), tenant, x_device_id, build_synced_receipt)
+  except SyncPayloadError as e:
+    raise HTTPException(status_code=e.status_code, detail={
+      "message": e.message, "seq": e.seq, "acked_seq": e.acked_seq, "errors": e.errors,
+    })
+  usage_tracker.incr(tenant.id, "receipts", result["accepted"])
+  RECEIPTS.inc("synced", result["accepted"])
+  return result
+
+
+@app.get("/sync/receipts/cursor")
+def get_sync_cursor(x_device_id: str = Header(min_length=1, max_length=100), tenant: Optional[Tenant] = Depends(authenticate_tenant)):
+  # Where to resume from, e.g. after the till crashed before it got the last ack
+  if tenant is None:
+    raise HTTPException(status_code=401, detail="Syncing needs the store's X-API-Key")
+  return {"device_id": x_device_id, "acked_seq": get_sync_cursor_seq(tenant.id, x_device_id)}
+
+
+# ADMIN: Bulk reissue. Re-renders and re-uploads PDFs for existing receipts (after a template change, storage move etc.)
+# The job runs in the background, progress lives in a checkpoint file so it survives restarts and can be resumed.
+REISSUE_CHECKPOINT_DIR = os.getenv("REISSUE_CHECKPOINT_DIR", tempfile.gettempdir())
+
+
+def reissue_checkpoint_path(job_id: str) -> str:
+  if not job_id.isalnum(): # job ids end up in a file name
+    raise HTTPException(status_code=400, detail="Invalid job id")
+  return os.path.join(REISSUE_CHECKPOINT_DIR, f"reissue-{job_id}.json")
+
+
+def run_reissue_job(checkpoint_path: str, **kwargs):
+  try:
+    reissue_receipts(checkpoint_path=checkpoint_path, **kwargs)
+  finally:
+    release_checkpoint_lock(checkpoint_path)
+
+
+@app.post("/admin/receipts/reissue", status_code=202, dependencies=[Depends(require_admin)])
+def start_reissue(request: ReissueRequest, background_tasks: BackgroundTasks):
+  job_id = request.resume_job_id or uuid.uuid4().hex
+  checkpoint_path = reissue_checkpoint_path(job_id)
+  if request.resume_job_id:
+    if not os.path.exists(checkpoint_path):
+      raise HTTPException(status_code=404, detail=f"No reissue checkpoint for job {job_id}")
+    try: # Check up front, otherwise the mismatch would only blow up inside the background task
+      load_checkpoint(checkpoint_path, filters_key(request.store, request.date_from, request.date_to))
+    except ValueError as e:
+      raise HTTPException(status_code=409, detail=str(e))
+
+  # Two jobs on one checkpoint would overwrite each other's progress and reissue the same receipts twice
+  if not acquire_checkpoint_lock(checkpoint_path):
+    raise HTTPException(status_code=409, detail=f"Reissue job {job_id} is still running")
+  background_tasks.add_task(
+    run_reissue_job,
+    checkpoint_path,
+    store=request.store,
+    date_from=request.date_from,
+    date_to=request.date_to,
+    chunk_size=request.chunk_size,
+    concurrency=request.concurrency,
+    resume=bool(request.resume_job_id),
+    retry_failed=request.retry_failed,
+  )
+  return {"job_id": job_id, "status_url": f"/admin/receipts/reissue/{job_id}"}
+
+
+@app.get("/admin/receipts/reissue/{job_id}", dependencies=[Depends(require_admin)])
+def get_reissue_status(job_id: str):
+  path = reissue_checkpoint_path(job_id)
+  if not os.path.exists(path):
+    raise HTTPException(status_code=404, detail=f"Reissue job {job_id} not found")
+  with open(path) as f:
+    return json.load(f)
+
+
+
+# ADMIN: Store tenants. The API key is only ever shown in the create/rotate response, the DB keeps its sha256
+@app.post("/admin/tenants", status_code=201, dependencies=[Depends(require_admin)])
+def create_tenant(request: TenantCreate, db: Session = Depends(get_db_session)):
+  if db.query(StoreTenant).filter(StoreTenant.name == request.name).first():
+    raise HTTPException(status_code=409, detail=f"Store {request.name} already exists")
+  api_key = generate_api_key()
+  tenant = StoreTenant(api_key_hash=hash_api_key(api_key), **request.model_dump())
+  db.add(tenant)
+  db.commit()
+  db.refresh(tenant)
+  return {"id": tenant.id, "name": tenant.name, "api_key": api_key}
+
+
+@app.post("/admin/tenants/{tenant_id}/rotate-key", dependencies=[Depends(require_admin)])
+def rotate_tenant_key(tenant_id: int, db: Session = Depends(get_db_session)):
+  tenant = db.query(StoreTenant).filter(StoreTenant.id == tenant_id).first()
+  if not tenant:
+    raise HTTPException(status_code=404, detail=f"Tenant {tenant_id} not found")
+  api_key = generate_api_key()
+  tenant.api_key_hash = hash_api_key(api_key)
+  db.commit()
+  tenant_registry.invalidate(tenant.id) # Other workers pick the new key up within TENANT_CACHE_SECONDS
+  return {"id": tenant.id, "name": tenant.name, "api_key": api_key}
+
+
+@app.get("/admin/tenants/{tenant_id}/usage", dependencies=[Depends(require_admin)])
+def get_tenant_usage(tenant_id: int, days: int = Query(default=30, ge=1, le=366), db: Session = Depends(get_db_session)):
+  usage_tracker.flush() # Include this worker's unflushed counts
+  rows = (
+    db.query(TenantUsage)
+    .filter(TenantUsage.tenant_id == tenant_id)
+    .order_by(TenantUsage.day.desc())
+    .limit(days)
+    .all()
+  )
+  return [
+    {"day": r.day, "receipts": r.receipts, "renders": r.renders, "emails": r.emails, "rate_limited": r.rate_limited}
+    for r in rows
+  ]
+
+
+
+# ADMIN: Per store receipt branding. Saving bumps the version, which makes every worker recompile that store's
+# header/footer on its next receipt (this worker straight away, the others within BRANDING_CHECK_SECONDS)
+BRANDING_FIELDS = ("theme", "brand_name", "branding_text", "watermark_text", "footer_text", "primary_color", "primary_dark_color", "accent_color")
+
+
+def branding_to_dict(branding: StoreBranding) -> dict:
+  data = {field: getattr(branding, field) for field in BRANDING_FIELDS}
+  data.update(business_store=branding.business_store, version=branding.version, updated_at=branding.updated_at)
+  return data
+
+
+@app.get("/admin/stores/{business_store}/branding", dependencies=[Depends(require_admin)])
+def get_store_branding(business_store: str, db: Session = Depends(get_db_session)):
+  branding = db.query(StoreBranding).filter(StoreBranding.business_store == business_store).first()
+  if not branding:
+    raise HTTPException(status_code=404, detail=f"No branding for {business_store}, receipts use the default look")
+  return branding_to_dict(branding)
+
+
+@app.put("/admin/stores/{business_store}/branding", dependencies=[Depends(require_admin)])
+def update_store_branding(business_store: str, request: StoreBrandingUpdate, db: Session = Depends(get_db_session)):
+  if request.theme not in available_themes():
+    raise HTTPException(status_code=400, detail=f"Unknown theme {request.theme}, available: {available_themes()}")
+
+  branding = db.query(StoreBranding).filter(StoreBranding.business_store == business_store).first()
+  if branding is None:
+    branding = StoreBranding(business_store=business_store, version=0)
+    db.add(branding)
+  for field, value in request.model_dump().items():
+    setattr(branding, field, value)
+  branding.version += 1
+  db.commit()
+  db.refresh(branding)
+  template_registry.invalidate(business_store)
+  return branding_to_dict(branding)
+
+
+
+# ADMIN: Uploads that failed UPLOAD_RETRY_MAX_ATTEMPTS times (the dead letter queue). Requeue once Cloudinary is fixed.
+@app.get("/admin/uploads/dead-letters", dependencies=[Depends(require_admin)])
+def list_dead_letter_uploads(limit: int = Query(default=100, ge=1, le=1000), db: Session = Depends(get_db_session)):
+  rows = (
+    db.query(UploadFailure, OrderReceipt.order_id, OrderReceipt.receipt_number, OrderReceipt.business_store)
+    .join(OrderReceipt, OrderReceipt.id == UploadFailure.receipt_id)
+    .filter(UploadFailure.status == "dead")
+    .order_by(UploadFailure.updated_at.desc())
+    .limit(limit)
+    .all()
+  )
+  return [
+    {
+      "receipt_id": failure.receipt_id,
+      "order_id": order_id,
+      "receipt_number": receipt_number,
+      "business_store": business_store,
+      "attempts": failure.attempts,
+      "last_error": failure.last_error,
+      "failed_at": failure.updated_at,
+    }
+    for failure, order_id, receipt_number, business_store in rows
+  ]
+
+
+@app.post("/admin/uploads/dead-letters/{receipt_id}/retry", dependencies=[Depends(require_admin)])
+def requeue_dead_letter_upload(receipt_id: int, db: Session = Depends(get_db_session)):
+  failure = db.query(UploadFailure).filter(UploadFailure.receipt_id == receipt_id, UploadFailure.status == "dead").first()
+  if not failure:
+    raise HTTPException(status_code=404, detail=f"Receipt {receipt_id} is not in the dead letter queue")
+  failure.status = "retrying"
+  failure.attempts = 0
+  failure.next_attempt_at = datetime.now(timezone.utc) # Picked up by the next sweep
+  db.commit()
+  return {"receipt_id": receipt_id, "status": failure.status}
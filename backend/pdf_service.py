@@ -0,0 +1,86 @@
+import io
+import os
+import time
+from typing import Optional
+import pdfkit # Using PDFKit since WeasyPrint refuses to work on my windows
+
+try:
+  import pikepdf # Optional, only used for the post-processing step below
+except ImportError:
+  pikepdf = None
+
+# This lives in its own module (and not in main.py) because the render pool's worker processes import it,
+# and they shouldn't have to import FastAPI, the DB engine and everything else main.py pulls in.
+
+
+# Output profiles, picked with PDF_PROFILE (or the "profile" argument). "options" are wkhtmltopdf flags (None = flag
+# without a value), "optimize" runs the PDF through pikepdf afterwards.
+#
+# What wkhtmltopdf already does on its own: Flate-compresses page content and embeds only the glyphs that are used
+# (Qt subsets fonts), so there is no separate subsetting switch to turn on. What's left to win:
+#   - image-dpi / image-quality: downsample + JPEG-compress images (logos, once stores have them)
+#   - grayscale: drops the colour data, the brand colours come out as grey
+#   - lowquality: renders at a lower resolution, noticeably smaller, only for internal copies
+#   - optimize: moves the objects into compressed object streams (wkhtmltopdf writes PDF 1.4, where every object
+#     dictionary and the xref table are plain text), recompresses streams at the highest Flate level and drops unused
+#     resources. Lossless.
+PDF_PROFILES = {
+  "standard": {"options": {}, "optimize": False}, # Exactly what we always produced
+  "compact": {"options": {"image-dpi": "150", "image-quality": "80"}, "optimize": True},
+  "grayscale": {"options": {"image-dpi": "150", "image-quality": "80", "grayscale": None}, "optimize": True},
+  "draft": {"options": {"image-dpi": "96", "image-quality": "60", "grayscale": None, "lowquality": None}, "optimize": True},
+}
+# "standard" until `run_benchmarks pdf` has been run against real wkhtmltopdf output, the others are opt-in for now
+PDF_PROFILE = os.getenv("PDF_PROFILE", "standard")
+if PDF_PROFILE not in PDF_PROFILES: # Fail at startup, not in the render worker after the receipt is already saved
+  raise ValueError(f"Unknown PDF_PROFILE {PDF_PROFILE!r}, expected one of {', '.join(PDF_PROFILES)}")
+
+
+def optimize_pdf(pdf_bytes: bytes) -> bytes:
+  # Lossless, so whatever happens we can fall back to the input
+  if pikepdf is None:
+    return pdf_bytes
+  try:
+    with pikepdf.open(io.BytesIO(pdf_bytes)) as pdf:
+      pdf.remove_unreferenced_resources()
+      out = io.BytesIO()
+      pdf.save(
+        out,
+        compress_streams=True,
+        recompress_flate=True,
+        object_stream_mode=pikepdf.ObjectStreamMode.generate,
+        stream_decode_level=pikepdf.StreamDecodeLevel.generalized,
+        linearize=False,
+      )
+  except Exception:
+    return pdf_bytes
+  optimized = out.getvalue()
+  return optimized if len(optimized) < len(pdf_bytes) else pdf_bytes
+
+
+def html_to_pdf_bytes(html_str: str, profile: Optional[str] = None) -> bytes:
+  settings = PDF_PROFILES[profile or PDF_PROFILE]
+  pdf_bytes = pdfkit.from_string(html_str, False, options=settings["options"] or None)
+  if settings["optimize"]:
+    pdf_bytes = optimize_pdf(pdf_bytes)
+  return pdf_bytes
+  # return HTML(string=html_str).write_pdf() weasyprint not working on my PC, lol, maybe because it's a C library pkg
+
+
+def profile_report(html_str: str, profiles=None, render=html_to_pdf_bytes) -> list[dict]:
+  # Renders the same receipt with every profile and reports the size against "standard"
+  rows = []
+  baseline = None
+  for name in ["standard"] + [p for p in (profiles or PDF_PROFILES) if p != "standard"]:
+    start = time.perf_counter()
+    size = len(render(html_str, name))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    baseline = baseline or size
+    rows.append({
+      "profile": name,
+      "bytes": size,
+      "saved_bytes": baseline - size,
+      "saved_pct": round((baseline - size) / baseline * 100, 1) if baseline else 0.0,
+      "render_ms": round(elapsed_ms, 1),
+    })
+  return rows
@@ -0,0 +1,260 @@
+import os
+import zlib
+import json
+from datetime import datetime, timezone
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from starlette.concurrency import run_in_threadpool
+from database import SessionLocal
+from database_models import OrderReceipt, SyncCursor, UploadFailure
+from schemas import SyncReceipt
+from change_feed import record_event, receipt_to_event_dict
+
+try:
+  import orjson
+except ImportError: # pragma: no cover - same fallback as serializers.py
+  orjson = None
+
+try:
+  import zstandard # Optional, without it only gzip and uncompressed batches are accepted
+except ImportError:
+  zstandard = None
+
+
+# Offline POS sync. A till that was offline uploads its queued receipts in one request instead of one webhook call
+# per receipt:
+#
+#   POST /sync/receipts
+#   X-API-Key: <store key>          X-Device-Id: till-3          Content-Encoding: zstd | gzip (optional)
+#   {"seq": 41, "order_id": "...", ...ReceiptCreate fields..., "sold_at": "2026-10-19T09:12:00Z"}\n
+#   {"seq": 42, ...}\n
+#
+# The body is newline-delimited JSON, decompressed and parsed as it streams in, and committed every
+# SYNC_COMMIT_BATCH receipts together with the device's cursor (the highest seq committed). The response (and
+# GET /sync/receipts/cursor) returns that cursor as "acked_seq", and the till only resends what comes after it.
+# Anything at or below the cursor, and any order_id we already have, is skipped, so resending is always safe.
+#
+# Synced receipts skip the inline render/upload: they are queued for the upload retry sweep (upload_retry.py), which
+# renders, uploads and emails them at its own pace instead of a sync burst taking over the render pool.
+SYNC_COMMIT_BATCH = int(os.getenv("SYNC_COMMIT_BATCH", "250"))
+SYNC_MAX_RECORDS = int(os.getenv("SYNC_MAX_RECORDS", "5000")) # Per request, the rest is left for the next request
+SYNC_MAX_BYTES = int(os.getenv("SYNC_MAX_BYTES", str(64 * 1024 * 1024))) # Decompressed, guards against zip bombs
+MAX_LINE_BYTES = 1024 * 1024
+_UPSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+# The size limit is checked as the output is produced, a few KB of compressed input can expand to gigabytes.
+# gzip: one decompress() call returns at most DECOMPRESS_CHUNK_BYTES (max_length + unconsumed_tail).
+# zstd: its decompressobj has no max_length, so it is fed ZSTD_INPUT_SLICE bytes at a time. A zstd block decodes to
+# at most 128 KB and takes at least 4 bytes, so one call returns at most ~1 MB whatever the input.
+DECOMPRESS_CHUNK_BYTES = 64 * 1024
+ZSTD_INPUT_SLICE = 32
+
+
+class SyncPayloadError(Exception):
+  def __init__(self, status_code: int, message: str, seq=None, acked_seq=None, errors=None):
+    super().__init__(message)
+    self.status_code = status_code
+    self.message = message
+    self.seq = seq
+    self.acked_seq = acked_seq
+    self.errors = errors
+
+
+def _loads(line: bytes):
+  return orjson.loads(line) if orjson is not None else json.loads(line)
+
+
+def _identity(chunk: bytes):
+  yield chunk
+
+
+def _gzip_feeder():
+  decompressor = zlib.decompressobj(wbits=31)
+
+  def feed(chunk: bytes):
+    data = chunk
+    while not decompressor.eof:
+      try:
+        out = decompressor.decompress(data, DECOMPRESS_CHUNK_BYTES)
+      except zlib.error as e:
+        raise SyncPayloadError(400, f"Invalid gzip data: {e}")
+      if out:
+        yield out
+      data = decompressor.unconsumed_tail
+      if not data and len(out) < DECOMPRESS_CHUNK_BYTES: # Input used up and nothing left in zlib's output buffer
+        break
+  return feed
+
+
+def _zstd_feeder():
+  decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+  def feed(chunk: bytes):
+    for start in range(0, len(chunk), ZSTD_INPUT_SLICE):
+      if decompressor.eof: # zstd refuses any input after the end of its frame
+        return
+      try:
+        out = decompressor.decompress(chunk[start:start + ZSTD_INPUT_SLICE])
+      except zstandard.ZstdError as e:
+        raise SyncPayloadError(400, f"Invalid zstd data: {e}")
+      if out:
+        yield out
+  return feed
+
+
+def _decompressor(content_encoding: str):
+  # Returns feed(chunk), which yields the chunk's decompressed bytes in bounded pieces
+  encoding = (content_encoding or "identity").strip().lower()
+  if encoding == "identity":
+    return _identity
+  if encoding == "gzip":
+    return _gzip_feeder()
+  if encoding == "zstd" and zstandard is not None:
+    return _zstd_feeder()
+  raise SyncPayloadError(415, f"Unsupported Content-Encoding {encoding}, use gzip{', zstd' if zstandard else ''} or none")
+
+
+async def iter_lines(stream, content_encoding: str):
+  # Yields one NDJSON line at a time, only ever holding one network chunk, one decompressed piece and one partial
+  # line in memory
+  feed = _decompressor(content_encoding)
+  buffer = b""
+  total = 0
+  async for chunk in stream:
+    if not chunk: # Starlette ends the stream with b""
+      continue
+    for data in feed(chunk):
+      total += len(data)
+      if total > SYNC_MAX_BYTES:
+        raise SyncPayloadError(413, f"Batch is larger than {SYNC_MAX_BYTES} bytes uncompressed, send smaller batches")
+      buffer += data
+      *lines, buffer = buffer.split(b"\n")
+      for line in lines:
+        if line.strip():
+          yield line
+      if len(buffer) > MAX_LINE_BYTES:
+        raise SyncPayloadError(413, "A single receipt line is larger than 1 MB")
+  if buffer.strip():
+    yield buffer
+
+
+def get_cursor(tenant_id: int, device_id: str) -> int:
+  db = SessionLocal()
+  try:
+    row = db.query(SyncCursor.last_seq).filter(SyncCursor.tenant_id == tenant_id, SyncCursor.device_id == device_id).first()
+    return row[0] if row else 0
+  finally:
+    db.close()
+
+
+def _ensure_cursor(db, tenant_id: int, device_id: str):
+  # FOR UPDATE can only lock a row that exists, so a new device's cursor is created first. INSERT ... ON CONFLICT DO
+  # NOTHING means two first requests from the same till can't both insert it and fail one of them on the primary key.
+  insert = _UPSERTS.get(db.get_bind().dialect.name)
+  if insert is not None:
+    db.execute(insert(SyncCursor).values(tenant_id=tenant_id, device_id=device_id, last_seq=0).on_conflict_do_nothing())
+    return
+  if db.query(SyncCursor.last_seq).filter(SyncCursor.tenant_id == tenant_id, SyncCursor.device_id == device_id).first():
+    return
+  try: # Other databases: a savepoint around the INSERT, losing the race just means the row is there now
+    with db.begin_nested():
+      db.add(SyncCursor(tenant_id=tenant_id, device_id=device_id, last_seq=0))
+  except IntegrityError:
+    pass
+
+
+def commit_batch(tenant, device_id: str, records: list, build_receipt) -> dict:
+  # One transaction: the new receipts, their change feed events, their render/upload queue entries and the cursor
+  db = SessionLocal()
+  try:
+    _ensure_cursor(db, tenant.id, device_id)
+    cursor = (
+      db.query(SyncCursor)
+      .filter(SyncCursor.tenant_id == tenant.id, SyncCursor.device_id == device_id)
+      .with_for_update() # Two requests from the same till at once take turns here
+      .one()
+    )
+
+    fresh = [r for r in records if r.seq > cursor.last_seq]
+    existing = {
+      order_id for (order_id,) in
+      db.query(OrderReceipt.order_id).filter(OrderReceipt.order_id.in_([r.order_id for r in fresh])).all()
+    } if fresh else set()
+
+    created = []
+    for record in fresh:
+      if record.order_id in existing: # e.g. it went through the normal webhook before the till lost its connection
+        continue
+      existing.add(record.order_id)
+      receipt = build_receipt(record, tenant)
+      db.add(receipt)
+      created.append(receipt)
+    db.flush()
+
+    now = datetime.now(timezone.utc)
+    for receipt in created:
+      record_event(db, "receipt.created", receipt.id, receipt_to_event_dict(receipt))
+      db.add(UploadFailure(receipt_id=receipt.id, attempts=0, next_attempt_at=now)) # Due on the sweep's next pass
+    if fresh:
+      cursor.last_seq = max(cursor.last_seq, fresh[-1].seq)
+    db.commit()
+    return {
+      "acked_seq": cursor.last_seq,
+      "accepted": len(created),
+      "duplicates": len(fresh) - len(created),
+      "already_synced": len(records) - len(fresh),
+    }
+  finally:
+    db.close()
+
+
+async def ingest_stream(stream, content_encoding: str, tenant, device_id: str, build_receipt) -> dict:
+  result = {"device_id": device_id, "acked_seq": None, "accepted": 0, "duplicates": 0, "already_synced": 0, "more": False}
+  batch = []
+  last_seq = 0
+
+  async def flush():
+    if not batch:
+      return
+    counts = await run_in_threadpool(commit_batch, tenant, device_id, list(batch), build_receipt)
+    batch.clear()
+    result["acked_seq"] = counts.pop("acked_seq")
+    for key, value in counts.items():
+      result[key] += value
+
+  received = 0
+  try:
+    async for line in iter_lines(stream, content_encoding):
+      if received >= SYNC_MAX_RECORDS:
+        result["more"] = True # Keep reading so the client sees a normal response, but leave these for the next request
+        continue
+      try:
+        record = SyncReceipt.model_validate(_loads(line))
+      except ValidationError as e:
+        raise SyncPayloadError(422, "Invalid receipt", seq=_seq_of(line), errors=e.errors(include_url=False, include_context=False))
+      except ValueError:
+        raise SyncPayloadError(400, "Line is not valid JSON", seq=None)
+      if record.seq <= last_seq:
+        raise SyncPayloadError(422, f"Sequence numbers must increase, got {record.seq} after {last_seq}", seq=record.seq)
+      last_seq = record.seq
+      received += 1
+      batch.append(record)
+      if len(batch) >= SYNC_COMMIT_BATCH:
+        await flush()
+    await flush()
+  except SyncPayloadError as e:
+    await flush() # Everything before the bad line is fine, commit it so the client only has to fix/resend the rest
+    e.acked_seq = result["acked_seq"] if result["acked_seq"] is not None else await run_in_threadpool(get_cursor, tenant.id, device_id)
+    raise
+
+  if result["acked_seq"] is None: # Empty body, just report where the device stands
+    result["acked_seq"] = await run_in_threadpool(get_cursor, tenant.id, device_id)
+  return result
+
+
+def _seq_of(line: bytes):
+  try:
+    seq = _loads(line).get("seq")
+    return seq if isinstance(seq, int) else None
+  except Exception:
+    return None
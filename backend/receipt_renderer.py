@@ -0,0 +1,161 @@
+import os
+import time
+import threading
+from typing import Optional
+from pathlib import Path
+from jinja2 import Environment, select_autoescape, FileSystemLoader, TemplateNotFound
+from schemas import ReceiptCreate
+from database import SessionLocal
+from database_models import StoreBranding
+from telemetry import logger
+
+
+# Loading the "templates" folder
+TEMPLATES_DIR = Path(__file__).parent / "templates" # Relative to this file so the reissue CLI works from any folder
+env = Environment(
+  loader=FileSystemLoader(TEMPLATES_DIR),
+  autoescape=select_autoescape(["html", "xml"]),
+)
+
+# Each theme is a folder under templates/receipts/ with header.html, body.html and footer.html. The header (styles,
+# colours, brand name, watermark) and footer only depend on the store's branding, so they are rendered ONCE per store
+# and kept as plain strings. A receipt render is then just body.html (customer + items + totals) glued between them.
+DEFAULT_THEME = "classic"
+BRANDING_CHECK_SECONDS = float(os.getenv("BRANDING_CHECK_SECONDS", "30")) # How stale another worker's branding change can be
+
+DEFAULT_BRANDING = {
+  "brand_name": "Gaji",
+  "branding_text": "RECEIPTFLOW BY",
+  "watermark_text": "ReceiptFlow",
+  "footer_text": "Thank you for your business!",
+  "primary_color": "#6b5ce7",
+  "primary_dark_color": "#4a3eb5",
+  "accent_color": "#ffd700",
+}
+
+
+def available_themes() -> list[str]:
+  themes_dir = TEMPLATES_DIR / "receipts"
+  return sorted(p.name for p in themes_dir.iterdir() if (p / "body.html").exists())
+
+
+class CompiledReceiptTemplate:
+  def __init__(self, theme: str, version: int, header: str, body, footer: str):
+    self.theme = theme
+    self.version = version
+    self.header = header
+    self.body = body # jinja2 Template, Jinja caches the compiled code so this is shared by every store on the theme
+    self.footer = footer
+
+
+class TemplateRegistry:
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._compiled = {} # business_store -> CompiledReceiptTemplate
+    self._versions = {} # business_store -> StoreBranding.version, stores without a row are version 0
+    self._checked_at = 0.0
+
+  def _refresh_versions(self):
+    # One small query for every store's version, instead of one per render
+    db = SessionLocal()
+    try:
+      rows = db.query(StoreBranding.business_store, StoreBranding.version).all()
+    finally:
+      db.close()
+    with self._lock:
+      self._versions = dict(rows)
+      self._checked_at = time.monotonic()
+
+  def _load_branding(self, business_store: str):
+    db = SessionLocal()
+    try:
+      row = db.query(StoreBranding).filter(StoreBranding.business_store == business_store).first()
+      if row is None:
+        return DEFAULT_THEME, 0, dict(DEFAULT_BRANDING)
+      branding = {key: getattr(row, key) or default for key, default in DEFAULT_BRANDING.items()}
+      return row.theme, row.version, branding
+    finally:
+      db.close()
+
+  def _compile(self, business_store: str) -> CompiledReceiptTemplate:
+    try:
+      theme, version, branding = self._load_branding(business_store)
+    except Exception as e: # A branding problem should never stop a receipt from going out
+      logger.warning(f"branding load failed, using the default store={business_store!r} error={e!r}")
+      theme, version, branding = DEFAULT_THEME, self._versions.get(business_store, 0), dict(DEFAULT_BRANDING)
+
+    try:
+      templates = [env.get_template(f"receipts/{theme}/{part}.html") for part in ("header", "body", "footer")]
+    except TemplateNotFound:
+      logger.warning(f"receipt theme not found, using {DEFAULT_THEME} store={business_store!r} theme={theme!r}")
+      theme = DEFAULT_THEME
+      templates = [env.get_template(f"receipts/{theme}/{part}.html") for part in ("header", "body", "footer")]
+
+    header, body, footer = templates
+    return CompiledReceiptTemplate(
+      theme=theme,
+      version=version,
+      header=header.render(branding=branding, business_store=business_store),
+      body=body,
+      footer=footer.render(branding=branding, business_store=business_store),
+    )
+
+  def get(self, business_store: str) -> CompiledReceiptTemplate:
+    if time.monotonic() - self._checked_at > BRANDING_CHECK_SECONDS:
+      try:
+        self._refresh_versions()
+      except Exception as e:
+        logger.warning(f"branding version check failed error={e!r}")
+        self._checked_at = time.monotonic() # Don't retry on every render while the DB is unhappy
+
+    with self._lock:
+      compiled = self._compiled.get(business_store)
+      current_version = self._versions.get(business_store, 0)
+    if compiled is not None and compiled.version == current_version:
+      return compiled
+
+    compiled = self._compile(business_store)
+    with self._lock:
+      self._compiled[business_store] = compiled
+      self._versions[business_store] = compiled.version
+    return compiled
+
+  def invalidate(self, business_store: Optional[str] = None):
+    # Called after a branding change in this process. Other workers catch up within BRANDING_CHECK_SECONDS.
+    with self._lock:
+      if business_store is None:
+        self._compiled.clear()
+      else:
+        self._compiled.pop(business_store, None)
+      self._checked_at = 0.0
+
+
+template_registry = TemplateRegistry()
+
+
+# This is where the heavy work of turning receipt to Html occurs
+def receipt_to_html(data: ReceiptCreate):
+  compiled = template_registry.get(data.business_store)
+  subtotal = sum(i.quantity* i.unit_price for i in data.items) # Calculating the Subtotal
+  tax = subtotal * 0.10
+  total = subtotal + tax
+  payment_method = (
+    data.payment_method.value
+    if hasattr(data.payment_method, "value")
+    else data.payment_method
+  ) # Using this, just in case the db messes up the value of the Enum
+
+  business_store= data.business_store
+
+
+  # Declaring the variables, only the dynamic part is rendered here
+  body = compiled.body.render(
+    receipt=data,
+    total=total,
+    subtotal=subtotal,
+    tax=tax,
+    items = data.items,
+    payment_method = payment_method,
+    business_store = business_store
+    )
+  return compiled.header + body + compiled.footer
@@ -0,0 +1,244 @@
+# Re-render and re-upload the PDFs of receipts that are already in the DB, e.g. after changing a receipt theme or
+# moving storage. Replaying the webhook doesn't work for this (it 409s on the existing order_id).
+#
+# From the backend/ folder:
+#   python reissue.py --store "Tech Plaza" --from 2026-01-01 --to 2026-01-31 --checkpoint reissue-techplaza.json
+#
+# Receipts are streamed from the DB in id order, chunk by chunk, so memory stays flat no matter how many rows match.
+# After every chunk the new pdf_urls are written with one batched UPDATE and the last id is saved to the checkpoint
+# file. Add --resume to carry on from that checkpoint after a crash; without it every run starts from the beginning
+# (and overwrites the file), so the next template change isn't mistaken for an already finished job.
+# Receipts that failed are listed in the checkpoint's failed_ids and are NOT retried by --resume alone, add
+# --retry-failed to render them again first. Only one run can use a checkpoint at a time (see acquire_checkpoint_lock).
+
+import os
+import sys
+import json
+import time
+import argparse
+from typing import Optional
+from datetime import date, datetime, time as dt_time, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import update
+from sqlalchemy.orm import selectinload
+from database import SessionLocal
+from database_models import OrderReceipt
+from receipt_renderer import receipt_to_html
+from render_pool import render_pool
+from cloudinary_service import upload_pdf_to_cloudinary
+from telemetry import span, logger
+from change_feed import record_event
+
+
+def filters_key(store, date_from, date_to):
+  return {"store": store, "date_from": str(date_from) if date_from else None, "date_to": str(date_to) if date_to else None}
+
+
+def load_checkpoint(path, filters):
+  if not path or not os.path.exists(path):
+    return None
+  with open(path) as f:
+    checkpoint = json.load(f)
+  if checkpoint.get("filters") != filters:
+    raise ValueError(f"Checkpoint {path} was written for different filters {checkpoint.get('filters')}, refusing to resume")
+  return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+  if not path:
+    return
+  tmp_path = path + ".tmp"
+  with open(tmp_path, "w") as f:
+    json.dump(checkpoint, f, indent=2)
+  os.replace(tmp_path, path) # Atomic, so a crash mid-write never leaves a half written checkpoint
+
+
+def acquire_checkpoint_lock(path) -> bool:
+  # One run per checkpoint at a time, across processes: "<checkpoint>.lock" is created with O_EXCL and holds the
+  # owner's pid, so a lock left behind by a run that crashed can be taken over.
+  lock_path = path + ".lock"
+  for _ in range(2):
+    try:
+      fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+      if _lock_owner_alive(lock_path):
+        return False
+      try:
+        os.remove(lock_path)
+      except FileNotFoundError:
+        pass
+      continue
+    with os.fdopen(fd, "w") as f:
+      f.write(str(os.getpid()))
+    return True
+  return False
+
+
+def _lock_owner_alive(lock_path) -> bool:
+  try:
+    with open(lock_path) as f:
+      pid = int(f.read().strip())
+  except FileNotFoundError:
+    return False
+  except (OSError, ValueError): # Still being written by its owner
+    return True
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError: # Exists, just not ours
+    return True
+  return True
+
+
+def release_checkpoint_lock(path):
+  try:
+    os.remove(path + ".lock")
+  except FileNotFoundError:
+    pass
+
+
+def _reissue_one(receipt_id, order_id, receipt_number, html):
+  with span("reissue_render"):
+    pdf_bytes = render_pool.render_when_admitted(html) # The pool is shared with live webhooks when this runs in the API
+  with span("reissue_upload"):
+    pdf_url = upload_pdf_to_cloudinary(pdf_bytes, public_id=f"{order_id}-{receipt_number}")
+  return {"id": receipt_id, "pdf_url": pdf_url}
+
+
+def _reissue_chunk(db, pool, chunk, checkpoint) -> list:
+  # Jinja rendering is cheap, do it here while the ORM objects are attached; the PDF + upload go to the pool
+  futures = {
+    pool.submit(_reissue_one, r.id, r.order_id, r.receipt_number, receipt_to_html(r)): r.id
+    for r in chunk
+  }
+  updates = []
+  for future, receipt_id in futures.items():
+    try:
+      updates.append(future.result())
+    except Exception as e:
+      logger.warning(f"reissue failed receipt_id={receipt_id} error={e!r}")
+      checkpoint["failed_ids"].append(receipt_id)
+
+  if updates:
+    with span("reissue_db_update"):
+      db.execute(update(OrderReceipt), updates) # One executemany UPDATE ... WHERE id = ? for the whole chunk
+    for u in updates:
+      record_event(db, "receipt.pdf_updated", u["id"], u)
+  db.commit()
+  db.expunge_all() # Drop the chunk from the identity map so memory doesn't grow with the run
+  return updates
+
+
+def reissue_receipts(
+    store: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    chunk_size: int = 200,
+    concurrency: int = 8,
+    checkpoint_path: Optional[str] = None,
+    resume: bool = False,
+    retry_failed: bool = False,
+    on_progress=None):
+  filters = filters_key(store, date_from, date_to)
+  checkpoint = (load_checkpoint(checkpoint_path, filters) if resume else None) or {
+    "filters": filters, "last_id": 0, "processed": 0, "failed_ids": [], "done": False,
+  }
+  retry_ids = sorted(set(checkpoint["failed_ids"])) if retry_failed else []
+  if checkpoint["done"] and not retry_ids:
+    logger.info(f"reissue already finished according to {checkpoint_path}, nothing to do (start without --resume to run it again)")
+    return checkpoint
+
+  checkpoint["done"] = False
+  save_checkpoint(checkpoint_path, checkpoint) # Straight away, so a status check right after starting finds the job
+  started = time.perf_counter()
+  processed_this_run = 0
+
+  def report(updates):
+    nonlocal processed_this_run
+    checkpoint["processed"] += len(updates)
+    processed_this_run += len(updates)
+    elapsed = time.perf_counter() - started
+    checkpoint["receipts_per_second"] = round(processed_this_run / elapsed, 2) if elapsed else 0.0
+    save_checkpoint(checkpoint_path, checkpoint)
+    logger.info(
+      f"reissue progress last_id={checkpoint['last_id']} processed={checkpoint['processed']} "
+      f"failed={len(checkpoint['failed_ids'])} rate={checkpoint['receipts_per_second']}/s"
+    )
+    if on_progress:
+      on_progress(updates, checkpoint)
+
+  db = SessionLocal()
+  try:
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+      # Earlier failures first. They are taken off the list now and go back on it if they fail again.
+      checkpoint["failed_ids"] = [i for i in checkpoint["failed_ids"] if i not in retry_ids]
+      for n in range(0, len(retry_ids), chunk_size):
+        ids = retry_ids[n:n + chunk_size]
+        chunk = db.query(OrderReceipt).options(selectinload(OrderReceipt.items)).filter(OrderReceipt.id.in_(ids)).all()
+        report(_reissue_chunk(db, pool, chunk, checkpoint))
+
+      while True:
+        query = (
+          db.query(OrderReceipt)
+          .options(selectinload(OrderReceipt.items))
+          .filter(OrderReceipt.id > checkpoint["last_id"])
+        )
+        if store:
+          query = query.filter(OrderReceipt.business_store == store)
+        if date_from:
+          query = query.filter(OrderReceipt.created_at >= datetime.combine(date_from, dt_time.min))
+        if date_to: # Inclusive, so everything before the start of the next day
+          query = query.filter(OrderReceipt.created_at < datetime.combine(date_to + timedelta(days=1), dt_time.min))
+        chunk = query.order_by(OrderReceipt.id).limit(chunk_size).all()
+        if not chunk:
+          break
+        last_id = chunk[-1].id
+        updates = _reissue_chunk(db, pool, chunk, checkpoint)
+        checkpoint["last_id"] = last_id
+        report(updates)
+  finally:
+    db.close()
+
+  checkpoint["done"] = True
+  save_checkpoint(checkpoint_path, checkpoint)
+  return checkpoint
+
+
+def main_cli(argv=None):
+  parser = argparse.ArgumentParser(description="Re-render and re-upload receipt PDFs for existing receipts")
+  parser.add_argument("--store", help="Only receipts for this business_store")
+  parser.add_argument("--from", dest="date_from", type=date.fromisoformat, help="YYYY-MM-DD, inclusive")
+  parser.add_argument("--to", dest="date_to", type=date.fromisoformat, help="YYYY-MM-DD, inclusive")
+  parser.add_argument("--chunk-size", type=int, default=200)
+  parser.add_argument("--concurrency", type=int, default=8, help="Receipts rendered/uploaded at the same time")
+  parser.add_argument("--checkpoint", default="reissue-checkpoint.json", help="Progress file, written after every chunk")
+  parser.add_argument("--resume", action="store_true", help="Carry on from --checkpoint instead of starting over")
+  parser.add_argument("--retry-failed", action="store_true", help="With --resume, render the checkpoint's failed_ids again first")
+  args = parser.parse_args(argv)
+  if args.retry_failed and not args.resume:
+    parser.error("--retry-failed only makes sense together with --resume")
+
+  if not acquire_checkpoint_lock(args.checkpoint):
+    parser.error(f"another reissue is already running with {args.checkpoint}")
+  try:
+    result = reissue_receipts(
+      store=args.store,
+      date_from=args.date_from,
+      date_to=args.date_to,
+      chunk_size=args.chunk_size,
+      concurrency=args.concurrency,
+      checkpoint_path=args.checkpoint,
+      resume=args.resume,
+      retry_failed=args.retry_failed,
+    )
+  finally:
+    release_checkpoint_lock(args.checkpoint)
+    render_pool.shutdown()
+
+  print(json.dumps(result, indent=2))
+  return 1 if result["failed_ids"] else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main_cli())
@@ -0,0 +1,173 @@
+import os
+import math
+import time
+import threading
+from typing import Optional
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pdf_service import html_to_pdf_bytes
+from telemetry import logger
+
+
+# PDF rendering is CPU bound, so it runs in a process pool sized to the machine's cores instead of on the request threads.
+# On top of the pool there's an admission limit: at most RENDER_WORKERS renders running + RENDER_QUEUE_SIZE waiting.
+# When that's full we refuse new work straight away (the webhook turns it into a 503 + Retry-After) rather than
+# letting every in-flight request slow down.
+# Slots are also shared fairly between store tenants: while several tenants have renders in flight, each one can hold
+# at most capacity / active tenants, so one store's end-of-day burst can't take every slot.
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "0")) or os.cpu_count() or 1
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "0")) or RENDER_WORKERS * 2
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "60"))
+# Background jobs (reissue, upload retries) wait for slots instead of getting a 503, so without a cap of their own
+# they would grab every slot as soon as it frees up and live webhooks would get nothing but 503s. They get at most
+# this many slots (0 = half the capacity, at least 1) and the rest is always left for webhooks.
+RENDER_BACKGROUND_SLOTS = int(os.getenv("RENDER_BACKGROUND_SLOTS", "0"))
+BACKGROUND_TENANT_KEY = "background" # All background renders are one group in the fair share, next to the stores
+
+
+class RenderQueueFull(Exception):
+  def __init__(self, retry_after: int):
+    super().__init__(f"Render queue is full, retry in {retry_after}s")
+    self.retry_after = retry_after
+
+
+class RenderSlot:
+  # Returned by RenderPool.admit(), gives the slot back when the "with" block ends
+  def __init__(self, pool, tenant_key):
+    self._pool = pool
+    self._tenant_key = tenant_key
+    self._released = False
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.release()
+    return False
+
+  def release(self):
+    if not self._released:
+      self._released = True
+      self._pool._release(self._tenant_key)
+
+
+class RenderPool:
+  def __init__(
+      self,
+      workers: int = RENDER_WORKERS,
+      queue_size: int = RENDER_QUEUE_SIZE,
+      render_func=html_to_pdf_bytes,
+      background_slots: int = RENDER_BACKGROUND_SLOTS):
+    self.workers = workers
+    self.capacity = workers + queue_size
+    self.background_capacity = min(self.capacity - 1, background_slots or self.capacity // 2) or 1
+    self._background = threading.BoundedSemaphore(self.background_capacity)
+    self.render_func = render_func # Must be a top level function so it can be pickled over to the workers
+    self._lock = threading.Lock()
+    self._in_flight = 0
+    self._per_tenant = {} # tenant key -> slots held, only tenants currently holding slots are in here
+    self._executor = None
+    self._avg_render_seconds = 1.0 # Moving average, only used to work out Retry-After
+
+  def _get_executor(self):
+    # Created lazily so each uvicorn worker process gets its own pool after it has started
+    with self._lock:
+      if self._executor is None:
+        self._executor = ProcessPoolExecutor(
+          max_workers=self.workers,
+          mp_context=multiprocessing.get_context("spawn"), # Forking a process that already runs threads isn't safe
+        )
+      return self._executor
+
+  def _discard_executor(self, executor, kill: bool = False):
+    with self._lock:
+      if self._executor is executor: # Another thread may already have replaced it
+        self._executor = None
+    if kill:
+      processes = getattr(executor, "_processes", None) or {} # No public API to stop a running task
+      for process in list(processes.values()):
+        process.kill()
+      executor.shutdown(wait=False, cancel_futures=True)
+
+  def retry_after(self) -> int:
+    # Roughly how long until the current backlog has drained through the workers
+    with self._lock:
+      backlog = self._in_flight
+    return max(1, math.ceil(backlog / self.workers * self._avg_render_seconds))
+
+  def fair_share(self, tenant_key) -> int:
+    # Call with the lock held
+    active = len(self._per_tenant) + (0 if tenant_key in self._per_tenant else 1)
+    return max(1, self.capacity // active)
+
+  def admit(self, tenant_key=None) -> RenderSlot:
+    with self._lock:
+      held = self._per_tenant.get(tenant_key, 0)
+      full = self._in_flight >= self.capacity or held >= self.fair_share(tenant_key)
+      if not full:
+        self._in_flight += 1
+        self._per_tenant[tenant_key] = held + 1
+    if full:
+      raise RenderQueueFull(self.retry_after())
+    return RenderSlot(self, tenant_key)
+
+  def _release(self, tenant_key=None):
+    with self._lock:
+      self._in_flight -= 1
+      held = self._per_tenant.get(tenant_key, 0) - 1
+      if held > 0:
+        self._per_tenant[tenant_key] = held
+      else:
+        self._per_tenant.pop(tenant_key, None)
+
+  def in_flight(self) -> int:
+    with self._lock:
+      return self._in_flight
+
+  def render(self, html_str: str, profile: Optional[str] = None) -> bytes:
+    # Callers should hold a RenderSlot from admit(), that's what keeps the pool's queue bounded.
+    # profile is one of pdf_service.PDF_PROFILES, None = PDF_PROFILE
+    start = time.perf_counter()
+    executor = self._get_executor()
+    future = executor.submit(self.render_func, html_str, profile)
+    try:
+      pdf_bytes = future.result(timeout=RENDER_TIMEOUT)
+    except BrokenProcessPool:
+      # A worker died (e.g. wkhtmltopdf crashed hard), throw the pool away so the next render gets a fresh one
+      logger.warning("render pool broken, recreating it")
+      self._discard_executor(executor)
+      raise
+    except FutureTimeoutError:
+      # The caller gives up here, but the render would keep a worker busy (and everything queued behind it) while
+      # admission thinks the slot is free again. Kill the pool instead, renders still running in it fail with
+      # BrokenProcessPool and the next render gets a fresh one.
+      logger.warning(f"render timed out after {RENDER_TIMEOUT}s, recreating the render pool")
+      self._discard_executor(executor, kill=True)
+      raise
+    with self._lock:
+      self._avg_render_seconds = 0.9 * self._avg_render_seconds + 0.1 * (time.perf_counter() - start)
+    return pdf_bytes
+
+  def render_when_admitted(self, html_str: str) -> bytes:
+    # For background jobs (reissue, upload retries): wait for a slot instead of failing, live webhooks get 503s instead.
+    # Extra background threads queue on the semaphore, so a job with concurrency=8 still holds at most
+    # background_capacity slots.
+    with self._background:
+      while True:
+        try:
+          slot = self.admit(BACKGROUND_TENANT_KEY)
+          break
+        except RenderQueueFull as e:
+          time.sleep(e.retry_after)
+      with slot:
+        return self.render(html_str)
+
+  def shutdown(self):
+    with self._lock:
+      executor, self._executor = self._executor, None
+    if executor is not None:
+      executor.shutdown(wait=True, cancel_futures=True)
+
+
+render_pool = RenderPool()
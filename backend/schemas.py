@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr, ConfigDict
+from pydantic import BaseModel, EmailStr, ConfigDict, Field
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, date
 from enum import Enum
 
 class PaymentMethod(str, Enum):
@@ -29,6 +29,14 @@ class ReceiptCreate(BaseModel):
 
 
 
+# One line of an offline POS sync batch (POST /sync/receipts), a normal receipt plus the device's sequence number
+class SyncReceipt(ReceiptCreate):
+  seq: int = Field(ge=1, le=2**31 - 1) # sync_cursors.last_seq is a 32-bit INTEGER
+  sold_at: Optional[datetime] = None # When the sale happened on the till, defaults to when it reaches us
+
+
+
+
 class ReceiptItemResponse(ReceiptItemCreate):
   model_config = ConfigDict(from_attributes = True) # This is  why FastAPI is better, if the item is not available in the table of the db, it checks if the item is an attribute from another table and uses .notation to pluck it's value
 
@@ -39,19 +47,55 @@ class ReceiptResponse(BaseModel):
   model_config = ConfigDict(from_attributes=True) # This allows the response model work with sqlalchemy model.
   id: int
   order_id: str
+  receipt_number: str
 
   customer_name: str
-  customer_email: EmailStr
+  customer_email: str # Plain str on the way OUT, it was already validated as an EmailStr on the way in
   payment_method: str
   business_store: str
 
   subtotal: float
-  tax: float
+  tax: Optional[float]
   total: float
-  pdf_url: str
+  pdf_url: Optional[str] # Null until the PDF upload has finished
   created_at: datetime
 
   items: List[ReceiptItemResponse]
 
 
 
+
+
+# Admin: bulk re-render + re-upload of existing receipts
+class ReissueRequest(BaseModel):
+  store: Optional[str] = None
+  date_from: Optional[date] = None
+  date_to: Optional[date] = None
+  chunk_size: int = Field(default=200, ge=1, le=5000)
+  concurrency: int = Field(default=8, ge=1, le=64)
+  resume_job_id: Optional[str] = None # Pass a previous job's id to carry on from its checkpoint
+  retry_failed: bool = False # With resume_job_id: render that job's failed receipts again first
+
+
+
+# Admin: registering a store tenant
+class TenantCreate(BaseModel):
+  name: str
+  rate_per_second: float = Field(default=5.0, gt=0)
+  burst: int = Field(default=20, ge=1)
+  daily_email_quota: Optional[int] = Field(default=None, ge=0)
+
+
+
+# Admin: a store's receipt branding. Colours go straight into the receipt's CSS, so only #rrggbb is accepted
+HEX_COLOR = r"^#[0-9a-fA-F]{6}$"
+
+class StoreBrandingUpdate(BaseModel):
+  theme: str = Field(default="classic", pattern=r"^[a-z0-9_-]+$")
+  brand_name: Optional[str] = Field(default=None, max_length=40)
+  branding_text: Optional[str] = Field(default=None, max_length=60)
+  watermark_text: Optional[str] = Field(default=None, max_length=40)
+  footer_text: Optional[str] = Field(default=None, max_length=200)
+  primary_color: Optional[str] = Field(default=None, pattern=HEX_COLOR)
+  primary_dark_color: Optional[str] = Field(default=None, pattern=HEX_COLOR)
+  accent_color: Optional[str] = Field(default=None, pattern=HEX_COLOR)
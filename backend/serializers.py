@@ -0,0 +1,130 @@
+import os
+import gzip
+import json
+from collections import defaultdict
+from fastapi import Request
+from fastapi.responses import Response
+from database_models import OrderReceipt, Item
+
+try:
+  import orjson # Several times faster than the json module and handles datetimes natively
+except ImportError: # pragma: no cover - orjson is in requirements.txt, this is just so a bare install still works
+  orjson = None
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+
+# The list/detail endpoints used to return ORM objects and let FastAPI's jsonable_encoder walk every attribute of every
+# OrderReceipt and Item. Instead we SELECT just the columns the API returns, zip the row tuples straight into dicts with
+# the keys below, and encode them with orjson. Items come from one extra query for the whole page, not one per receipt.
+RECEIPT_COLUMNS = (
+  OrderReceipt.id,
+  OrderReceipt.order_id,
+  OrderReceipt.receipt_number,
+  OrderReceipt.customer_name,
+  OrderReceipt.customer_email,
+  OrderReceipt.business_store,
+  OrderReceipt.payment_method,
+  OrderReceipt.subtotal,
+  OrderReceipt.tax,
+  OrderReceipt.total,
+  OrderReceipt.pdf_url,
+  OrderReceipt.created_at,
+)
+RECEIPT_KEYS = tuple(column.key for column in RECEIPT_COLUMNS)
+
+ITEM_COLUMNS = (Item.receipt_id, Item.id, Item.product_name, Item.quantity, Item.unit_price)
+ITEM_KEYS = ("id", "product_name", "quantity", "unit_price")
+
+# Responses smaller than this aren't worth the CPU to compress
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4 # Brotli's sweet spot for on-the-fly compression, higher levels are meant for static assets
+
+
+def receipt_rows_to_dicts(db, receipt_rows) -> list[dict]:
+  receipts = [dict(zip(RECEIPT_KEYS, row)) for row in receipt_rows]
+  if not receipts:
+    return receipts
+
+  items_by_receipt = defaultdict(list)
+  item_rows = (
+    db.query(*ITEM_COLUMNS)
+    .filter(Item.receipt_id.in_([r["id"] for r in receipts]))
+    .order_by(Item.receipt_id, Item.id)
+    .all()
+  )
+  for receipt_id, *values in item_rows:
+    items_by_receipt[receipt_id].append(dict(zip(ITEM_KEYS, values)))
+
+  for receipt in receipts:
+    receipt["items"] = items_by_receipt.get(receipt["id"], [])
+  return receipts
+
+
+def _default(obj):
+  if hasattr(obj, "isoformat"):
+    return obj.isoformat()
+  raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+  if orjson is not None:
+    return orjson.dumps(content)
+  return json.dumps(content, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+  media_type = "application/json"
+
+  def render(self, content) -> bytes:
+    return dumps(content)
+
+
+def accepted_encodings(accept_encoding: str) -> dict:
+  # "gzip;q=0.5, br, *;q=0" -> {"gzip": 0.5, "br": 1.0, "*": 0.0}. A coding with q=0 is refused, not accepted.
+  weights = {}
+  for part in accept_encoding.split(","):
+    coding, *params = [p.strip() for p in part.split(";")]
+    if not coding:
+      continue
+    q = 1.0
+    for param in params:
+      name, _, value = param.partition("=")
+      if name.strip().lower() == "q":
+        try:
+          q = float(value)
+        except ValueError:
+          q = 0.0
+    weights[coding.lower()] = q
+  return weights
+
+
+def pick_encoding(accept_encoding: str):
+  # The supported coding with the highest q (brotli wins a tie), None = send it uncompressed
+  weights = accepted_encodings(accept_encoding)
+  wildcard = weights.get("*", 0.0)
+  best, best_q = None, 0.0
+  for coding in (["br"] if brotli is not None else []) + ["gzip"]:
+    q = weights.get(coding, wildcard)
+    if q > best_q:
+      best, best_q = coding, q
+  return best
+
+
+def json_response(request: Request, content, status_code: int = 200) -> Response:
+  # Encodes once, then compresses with brotli or gzip if the client accepts it and the body is big enough
+  body = dumps(content)
+  headers = {"Vary": "Accept-Encoding"}
+  if len(body) >= COMPRESS_MIN_BYTES:
+    encoding = pick_encoding(request.headers.get("accept-encoding", ""))
+    if encoding == "br":
+      body = brotli.compress(body, quality=BROTLI_QUALITY)
+      headers["Content-Encoding"] = "br"
+    elif encoding == "gzip":
+      body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+      headers["Content-Encoding"] = "gzip"
+  return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
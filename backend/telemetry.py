@@ -0,0 +1,144 @@
+import os
+import time
+import random
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# Tracing is sampled: histograms are ALWAYS updated (a bisect and an add under a lock), but the structured
+# span log lines are only written for a fraction of receipts. TRACE_SAMPLE_RATE=1 logs every span, 0 logs none.
+# Failed spans are always logged, sampled or not.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+
+logger = logging.getLogger("receiptflow")
+if not logger.handlers:
+  handler = logging.StreamHandler()
+  handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+  logger.addHandler(handler)
+  logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+  logger.propagate = False
+
+
+# Seconds. Covers a sub-millisecond Jinja render up to a slow SMTP handshake
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+  def __init__(self, name: str, documentation: str, label_name: str, buckets=DEFAULT_BUCKETS):
+    self.name = name
+    self.documentation = documentation
+    self.label_name = label_name
+    self.buckets = tuple(buckets)
+    self._lock = threading.Lock()
+    self._series = {} # label value -> [bucket counts..., sum, count]
+
+  def observe(self, label_value: str, seconds: float):
+    index = bisect_left(self.buckets, seconds)
+    with self._lock:
+      series = self._series.get(label_value)
+      if series is None:
+        series = self._series[label_value] = [0] * (len(self.buckets) + 2)
+      if index < len(self.buckets):
+        series[index] += 1
+      series[-2] += seconds
+      series[-1] += 1
+
+  def expose(self) -> list[str]:
+    lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+    with self._lock:
+      snapshot = {label: list(series) for label, series in self._series.items()}
+    for label_value, series in sorted(snapshot.items()):
+      label = f'{self.label_name}="{label_value}"'
+      cumulative = 0
+      for bound, count in zip(self.buckets, series):
+        cumulative += count
+        lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+      lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series[-1]}')
+      lines.append(f"{self.name}_sum{{{label}}} {series[-2]}")
+      lines.append(f"{self.name}_count{{{label}}} {series[-1]}")
+    return lines
+
+
+class Counter:
+  def __init__(self, name: str, documentation: str, label_name: str):
+    self.name = name
+    self.documentation = documentation
+    self.label_name = label_name
+    self._lock = threading.Lock()
+    self._values = {}
+
+  def inc(self, label_value: str, amount: float = 1):
+    with self._lock:
+      self._values[label_value] = self._values.get(label_value, 0) + amount
+
+  def expose(self) -> list[str]:
+    lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+    with self._lock:
+      snapshot = dict(self._values)
+    for label_value, value in sorted(snapshot.items()):
+      lines.append(f'{self.name}{{{self.label_name}="{label_value}"}} {value}')
+    return lines
+
+
+STAGE_DURATION = Histogram(
+  "receiptflow_stage_duration_seconds",
+  "Time spent in each receipt pipeline stage (db_insert, html_render, pdf_render, upload, smtp...)",
+  "stage",
+)
+STAGE_ERRORS = Counter("receiptflow_stage_errors_total", "Pipeline stages that raised", "stage")
+RECEIPTS = Counter("receiptflow_receipts_total", "Webhook outcomes", "outcome")
+
+METRICS = [STAGE_DURATION, STAGE_ERRORS, RECEIPTS]
+
+
+def render_prometheus() -> str:
+  lines = []
+  for metric in METRICS:
+    lines.extend(metric.expose())
+  return "\n".join(lines) + "\n"
+
+
+# The current trace's tags (receipt_number, store...) and whether it was sampled.
+# Starlette copies the context into the threadpool, so spans inside sync endpoints pick it up.
+_trace = ContextVar("receiptflow_trace", default=None)
+
+
+def start_trace(**tags):
+  # Each request runs in its own copy of the context, so there's nothing to reset afterwards
+  _trace.set({"sampled": random.random() < TRACE_SAMPLE_RATE, "tags": tags})
+
+
+def tag_trace(**tags):
+  # Add tags once they are known, e.g. the receipt_number only exists after the DB insert
+  current = _trace.get()
+  if current is not None:
+    current["tags"].update(tags)
+
+
+def _format(stage: str, seconds: float, tags: dict) -> str:
+  fields = " ".join(f"{key}={value}" for key, value in tags.items() if value is not None)
+  return f"span={stage} duration_ms={seconds * 1000:.2f} {fields}".rstrip()
+
+
+@contextmanager
+def span(stage: str, **tags):
+  current = _trace.get()
+  start = time.perf_counter()
+  try:
+    yield
+  except Exception as e:
+    elapsed = time.perf_counter() - start
+    STAGE_DURATION.observe(stage, elapsed)
+    STAGE_ERRORS.inc(stage)
+    all_tags = {**(current["tags"] if current else {}), **tags, "error": repr(e)}
+    logger.warning(_format(stage, elapsed, all_tags))
+    raise
+  elapsed = time.perf_counter() - start
+  STAGE_DURATION.observe(stage, elapsed)
+  # Outside a trace (e.g. a background task on its own) fall back to sampling per span
+  sampled = current["sampled"] if current else random.random() < TRACE_SAMPLE_RATE
+  if sampled:
+    logger.info(_format(stage, elapsed, {**(current["tags"] if current else {}), **tags}))
@@ -0,0 +1,272 @@
+import os
+import math
+import time
+import hashlib
+import secrets
+import threading
+from datetime import date
+from typing import Optional
+from collections import defaultdict
+from fastapi import Header, HTTPException
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from database import SessionLocal
+from database_models import StoreTenant, TenantUsage
+from telemetry import logger
+
+
+# Webhook calls authenticate with the store's API key in "X-API-Key". Keyless calls are accepted too (the public demo
+# frontend makes them, and a key baked into its JS bundle wouldn't be a secret) but they are not rate limited or
+# metered. Set TENANT_AUTH_REQUIRED=true once every store integration sends its key.
+# The rate limit's token bucket lives in each process, so with N uvicorn workers a store gets up to N x its rate.
+# The daily email quota is counted in the DB and holds across workers.
+TENANT_AUTH_REQUIRED = os.getenv("TENANT_AUTH_REQUIRED", "false").lower() == "true"
+TENANT_CACHE_SECONDS = 60 # How long a key -> tenant lookup is trusted before re-reading the DB (e.g. after a key rotation)
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "30"))
+
+USAGE_FIELDS = ("receipts", "renders", "emails", "rate_limited")
+
+
+def hash_api_key(api_key: str) -> str:
+  return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def generate_api_key() -> str:
+  return "rf_" + secrets.token_urlsafe(32)
+
+
+# A plain snapshot of the tenant row, so it can be cached and shared between threads without a DB session
+class Tenant:
+  def __init__(self, row: StoreTenant):
+    self.id = row.id
+    self.name = row.name
+    self.rate_per_second = row.rate_per_second
+    self.burst = row.burst
+    self.daily_email_quota = row.daily_email_quota
+    self.active = row.active
+
+
+class TokenBucket:
+  def __init__(self, rate_per_second: float, burst: int):
+    self.rate = rate_per_second
+    self.capacity = burst
+    self.tokens = float(burst)
+    self.updated = time.monotonic()
+    self._lock = threading.Lock()
+
+  def try_acquire(self):
+    # Returns (allowed, seconds until the next token)
+    with self._lock:
+      now = time.monotonic()
+      self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+      self.updated = now
+      if self.tokens >= 1:
+        self.tokens -= 1
+        return True, 0.0
+      return False, (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class TenantRegistry:
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._by_key_hash = {} # key hash -> (Tenant or None, cached_at)
+    self._buckets = {} # tenant id -> TokenBucket
+
+  def lookup(self, api_key: str) -> Optional[Tenant]:
+    key_hash = hash_api_key(api_key)
+    now = time.monotonic()
+    with self._lock:
+      cached = self._by_key_hash.get(key_hash)
+    if cached and now - cached[1] < TENANT_CACHE_SECONDS:
+      return cached[0]
+
+    db = SessionLocal()
+    try:
+      row = db.query(StoreTenant).filter(StoreTenant.api_key_hash == key_hash).first()
+      tenant = Tenant(row) if row and row.active else None
+    finally:
+      db.close()
+    with self._lock:
+      self._by_key_hash[key_hash] = (tenant, now) # Unknown keys are cached too, so a bad client can't hammer the DB
+    return tenant
+
+  def get_by_id(self, tenant_id: Optional[int]) -> Optional[Tenant]:
+    # For background work that only has the receipt's tenant_id (e.g. upload retries), not cached
+    if tenant_id is None:
+      return None
+    db = SessionLocal()
+    try:
+      row = db.query(StoreTenant).filter(StoreTenant.id == tenant_id).first()
+      return Tenant(row) if row else None
+    finally:
+      db.close()
+
+  def invalidate(self, tenant_id: Optional[int] = None):
+    # Only the given tenant's cached keys and bucket, so e.g. one store's key rotation doesn't hand every other store
+    # a full burst. No tenant_id = everything.
+    with self._lock:
+      if tenant_id is None:
+        self._by_key_hash.clear()
+        self._buckets.clear()
+        return
+      for key_hash, (tenant, _) in list(self._by_key_hash.items()):
+        if tenant is not None and tenant.id == tenant_id:
+          del self._by_key_hash[key_hash]
+      self._buckets.pop(tenant_id, None)
+
+  def bucket(self, tenant: Tenant) -> TokenBucket:
+    with self._lock:
+      bucket = self._buckets.get(tenant.id)
+      if bucket is None or bucket.rate != tenant.rate_per_second or bucket.capacity != tenant.burst:
+        bucket = self._buckets[tenant.id] = TokenBucket(tenant.rate_per_second, tenant.burst)
+      return bucket
+
+
+class UsageTracker:
+  # Counters live in memory (a dict increment per event) and a background thread adds them onto tenant_usage
+  # every USAGE_FLUSH_SECONDS, so the hot path never waits on the DB for bookkeeping
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._pending = defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0)) # (tenant_id, day) -> counts
+    self._stop = threading.Event()
+    self._thread = None
+
+  def incr(self, tenant_id: Optional[int], field: str, amount: int = 1):
+    if tenant_id is None:
+      return
+    with self._lock:
+      self._pending[(tenant_id, date.today())][field] += amount
+
+  def reserve_email(self, tenant_id: int, quota: Optional[int]) -> bool:
+    # Stores with a quota count their emails straight in tenant_usage with a conditional UPDATE, so every email
+    # worker of every uvicorn process shares the same count and the quota can't be overshot. Stores without one
+    # are only metered, through the in-memory counters like everything else.
+    # Give the reservation back with release_email() if the send fails.
+    if quota is None:
+      self.incr(tenant_id, "emails")
+      return True
+    day = date.today()
+    db = SessionLocal()
+    try:
+      for attempt in range(2):
+        result = db.execute(
+          update(TenantUsage)
+          .where(TenantUsage.tenant_id == tenant_id, TenantUsage.day == day, TenantUsage.emails < quota)
+          .values(emails=TenantUsage.emails + 1)
+        )
+        if result.rowcount:
+          db.commit()
+          return True
+        if quota <= 0 or db.query(TenantUsage.tenant_id).filter(TenantUsage.tenant_id == tenant_id, TenantUsage.day == day).first():
+          db.rollback()
+          return False # The row exists, so the quota is used up
+        try:
+          # First email of the day. If another worker inserts the row at the same moment, go round and UPDATE it.
+          db.add(TenantUsage(tenant_id=tenant_id, day=day, receipts=0, renders=0, emails=1, rate_limited=0))
+          db.commit()
+          return True
+        except IntegrityError:
+          db.rollback()
+      return False
+    finally:
+      db.close()
+
+  def release_email(self, tenant_id: int, quota: Optional[int]):
+    if quota is None:
+      self.incr(tenant_id, "emails", -1)
+      return
+    db = SessionLocal()
+    try:
+      db.execute(
+        update(TenantUsage)
+        .where(TenantUsage.tenant_id == tenant_id, TenantUsage.day == date.today(), TenantUsage.emails > 0)
+        .values(emails=TenantUsage.emails - 1)
+      )
+      db.commit()
+    finally:
+      db.close()
+
+  def flush(self):
+    with self._lock:
+      pending, self._pending = self._pending, defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+    if not pending:
+      return
+    db = SessionLocal()
+    try:
+      for (tenant_id, day), counts in pending.items():
+        # UPDATE ... SET x = x + n first, INSERT only when the row doesn't exist yet. If another worker inserts it
+        # at the same moment, the IntegrityError tells us to fall back to the UPDATE.
+        for attempt in range(2):
+          result = db.execute(
+            update(TenantUsage)
+            .where(TenantUsage.tenant_id == tenant_id, TenantUsage.day == day)
+            .values({field: getattr(TenantUsage, field) + counts[field] for field in USAGE_FIELDS})
+          )
+          if result.rowcount:
+            break
+          try:
+            with db.begin_nested():
+              db.add(TenantUsage(tenant_id=tenant_id, day=day, **counts))
+            break
+          except IntegrityError:
+            continue
+      db.commit()
+    except Exception as e:
+      db.rollback()
+      logger.warning(f"usage flush failed, keeping counts for the next flush error={e!r}")
+      with self._lock:
+        for key, counts in pending.items():
+          for field in USAGE_FIELDS:
+            self._pending[key][field] += counts[field]
+    finally:
+      db.close()
+
+  def _run(self):
+    while not self._stop.wait(USAGE_FLUSH_SECONDS):
+      self.flush()
+
+  def start(self):
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._run, name="usage-flusher", daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+    if self._thread:
+      self._thread.join(timeout=5)
+    self.flush() # Don't lose the last few seconds of counts on shutdown
+
+
+tenant_registry = TenantRegistry()
+usage_tracker = UsageTracker()
+
+
+# FastAPI dependency for endpoints that only read: checks the key but doesn't charge the rate limit, which is there to
+# protect receipt ingestion. Returns None for keyless calls when auth isn't required.
+def authenticate_tenant(x_api_key: Optional[str] = Header(default=None)) -> Optional[Tenant]:
+  if not x_api_key:
+    if TENANT_AUTH_REQUIRED:
+      raise HTTPException(status_code=401, detail="Missing X-API-Key header")
+    return None
+
+  tenant = tenant_registry.lookup(x_api_key)
+  if tenant is None:
+    raise HTTPException(status_code=401, detail="Invalid API key")
+  return tenant
+
+
+# FastAPI dependency for tenant-authenticated endpoints that create work. Same as authenticate_tenant plus the rate limit.
+def require_tenant(x_api_key: Optional[str] = Header(default=None)) -> Optional[Tenant]:
+  tenant = authenticate_tenant(x_api_key)
+  if tenant is None:
+    return None
+
+  allowed, retry_after = tenant_registry.bucket(tenant).try_acquire()
+  if not allowed:
+    usage_tracker.incr(tenant.id, "rate_limited")
+    raise HTTPException(
+      status_code=429,
+      detail=f"Rate limit exceeded for store {tenant.name}",
+      headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+  return tenant
@@ -0,0 +1,226 @@
+import os
+import random
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import update
+from sqlalchemy.orm import selectinload
+from database import SessionLocal
+from database_models import OrderReceipt, UploadFailure
+from receipt_renderer import receipt_to_html
+from render_pool import render_pool
+from cloudinary_service import upload_pdf_to_cloudinary
+from change_feed import record_event
+from telemetry import span, logger, RECEIPTS
+
+
+# When the Cloudinary upload fails the receipt is already committed with pdf_url = NULL, and replaying the webhook
+# only gets a 409. So every receipt that still owes an upload carries an UploadFailure row:
+#   - the webhook adds one (mark_upload_pending) in the same commit as the receipt, due UPLOAD_RETRY_GRACE_SECONDS
+#     later, and deletes it in the same commit as the pdf_url. If the process dies in between, the row is still there.
+#   - when the upload fails, the webhook keeps the PDF bytes in PdfCache and moves the row to the backoff schedule
+#   - POS sync adds one due straight away, its receipts are never uploaded inline
+# A background sweep (one thread per worker process) retries the rows that are due, and ONLY those, so receipts
+# that never had a row (the seed data, anything from before this existed) are left alone:
+#   - backoff: attempt n waits a random time up to UPLOAD_RETRY_BASE_SECONDS * 2^n (full jitter), capped at
+#     UPLOAD_RETRY_MAX_DELAY_SECONDS, so a Cloudinary outage isn't followed by every worker retrying at once
+#   - at most UPLOAD_RETRY_CONCURRENCY uploads at a time per worker
+#   - after UPLOAD_RETRY_MAX_ATTEMPTS the row is marked "dead" and only an admin can put it back in the queue
+UPLOAD_RETRY_INTERVAL_SECONDS = float(os.getenv("UPLOAD_RETRY_INTERVAL_SECONDS", "30"))
+UPLOAD_RETRY_BASE_SECONDS = float(os.getenv("UPLOAD_RETRY_BASE_SECONDS", "30"))
+UPLOAD_RETRY_MAX_DELAY_SECONDS = float(os.getenv("UPLOAD_RETRY_MAX_DELAY_SECONDS", "3600"))
+UPLOAD_RETRY_MAX_ATTEMPTS = int(os.getenv("UPLOAD_RETRY_MAX_ATTEMPTS", "8"))
+UPLOAD_RETRY_CONCURRENCY = int(os.getenv("UPLOAD_RETRY_CONCURRENCY", "4"))
+UPLOAD_RETRY_GRACE_SECONDS = float(os.getenv("UPLOAD_RETRY_GRACE_SECONDS", "300")) # How long a live webhook has to upload
+UPLOAD_RETRY_BATCH = 100
+CLAIM_SECONDS = 600 # A claimed receipt isn't picked up by another worker's sweep for this long
+
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "receiptflow-pdf-cache"))
+PDF_CACHE_MAX_FILES = int(os.getenv("PDF_CACHE_MAX_FILES", "2000"))
+
+
+def utcnow():
+  return datetime.now(timezone.utc)
+
+
+def backoff_delay(attempts: int) -> float:
+  return random.uniform(0, min(UPLOAD_RETRY_MAX_DELAY_SECONDS, UPLOAD_RETRY_BASE_SECONDS * 2 ** attempts))
+
+
+class PdfCache:
+  # PDFs whose upload failed, on local disk so a retry doesn't have to render them again (and survives a restart).
+  # Keyed by receipt_number. Only failed uploads end up here, so it stays small; the oldest files go first when full.
+  def __init__(self, directory: str = PDF_CACHE_DIR, max_files: int = PDF_CACHE_MAX_FILES):
+    self.directory = Path(directory)
+    self.max_files = max_files
+
+  def _path(self, receipt_number: str) -> Path:
+    return self.directory / f"{receipt_number}.pdf"
+
+  def put(self, receipt_number: str, pdf_bytes: bytes):
+    try:
+      self.directory.mkdir(parents=True, exist_ok=True)
+      tmp_path = self._path(receipt_number).with_suffix(".tmp")
+      tmp_path.write_bytes(pdf_bytes)
+      os.replace(tmp_path, self._path(receipt_number))
+      self._evict()
+    except OSError as e: # Only an optimisation, the retry can always render the PDF again
+      logger.warning(f"pdf cache write failed receipt_number={receipt_number} error={e!r}")
+
+  def get(self, receipt_number: str) -> Optional[bytes]:
+    try:
+      return self._path(receipt_number).read_bytes()
+    except OSError:
+      return None
+
+  def discard(self, receipt_number: str):
+    self._path(receipt_number).unlink(missing_ok=True)
+
+  def _evict(self):
+    files = sorted(self.directory.glob("*.pdf"), key=lambda p: p.stat().st_mtime)
+    for path in files[:max(0, len(files) - self.max_files)]:
+      path.unlink(missing_ok=True)
+
+
+pdf_cache = PdfCache()
+
+
+def mark_upload_pending(db, receipt_id: int):
+  # Called by the webhook, in the transaction that inserts the receipt
+  db.add(UploadFailure(
+    receipt_id=receipt_id,
+    attempts=0,
+    next_attempt_at=utcnow() + timedelta(seconds=UPLOAD_RETRY_GRACE_SECONDS),
+  ))
+
+
+def clear_upload_pending(db, receipt_id: int):
+  # Called by the webhook, in the transaction that saves the pdf_url
+  db.query(UploadFailure).filter(UploadFailure.receipt_id == receipt_id).delete(synchronize_session=False)
+
+
+def record_upload_failure(db, receipt_id: int, error: str):
+  # Called by the webhook, in its own session's transaction. Puts the pending row on the backoff schedule.
+  failure = db.get(UploadFailure, receipt_id)
+  if failure is None:
+    failure = UploadFailure(receipt_id=receipt_id)
+    db.add(failure)
+  failure.attempts = 1
+  failure.last_error = error
+  failure.next_attempt_at = utcnow() + timedelta(seconds=backoff_delay(1))
+
+
+class UploadRetrier:
+  def __init__(self, concurrency: int = UPLOAD_RETRY_CONCURRENCY):
+    self.concurrency = concurrency
+    self.on_uploaded = None # main.py hooks the receipt emails in here, they were never sent for these receipts
+    self._stop = threading.Event()
+    self._thread = None
+
+  def _due_receipts(self, db) -> list:
+    return (
+      db.query(UploadFailure.receipt_id, UploadFailure.next_attempt_at)
+      .filter(UploadFailure.status == "retrying", UploadFailure.next_attempt_at <= utcnow())
+      .order_by(UploadFailure.next_attempt_at)
+      .limit(UPLOAD_RETRY_BATCH)
+      .all()
+    )
+
+  def _claim(self, db, receipt_id: int, next_attempt_at) -> bool:
+    # Several uvicorn workers run this sweep. Pushing next_attempt_at forward with a compare-and-set UPDATE makes
+    # exactly one of them own the retry.
+    result = db.execute(
+      update(UploadFailure)
+      .where(UploadFailure.receipt_id == receipt_id, UploadFailure.next_attempt_at == next_attempt_at)
+      .values(next_attempt_at=utcnow() + timedelta(seconds=CLAIM_SECONDS))
+    )
+    db.commit()
+    return result.rowcount == 1
+
+  def _retry_one(self, receipt_id: int):
+    db = SessionLocal()
+    try:
+      receipt = db.query(OrderReceipt).options(selectinload(OrderReceipt.items)).filter(OrderReceipt.id == receipt_id).first()
+      failure = db.query(UploadFailure).filter(UploadFailure.receipt_id == receipt_id).first()
+      if receipt is None or failure is None:
+        return
+      if receipt.pdf_url: # Uploaded in the meantime (reissue, a manual fix...)
+        db.delete(failure)
+        db.commit()
+        return
+
+      try:
+        pdf_bytes = pdf_cache.get(receipt.receipt_number)
+        if pdf_bytes is None:
+          with span("retry_render"):
+            pdf_bytes = render_pool.render_when_admitted(receipt_to_html(receipt))
+        with span("retry_upload", receipt_id=receipt_id, attempt=failure.attempts + 1):
+          pdf_url = upload_pdf_to_cloudinary(pdf_bytes, public_id=f"{receipt.order_id}-{receipt.receipt_number}")
+      except Exception as e:
+        failure.attempts += 1
+        failure.last_error = repr(e)
+        if failure.attempts >= UPLOAD_RETRY_MAX_ATTEMPTS:
+          failure.status = "dead"
+          RECEIPTS.inc("upload_dead_lettered")
+          logger.warning(f"upload dead lettered receipt_id={receipt_id} attempts={failure.attempts} error={e!r}")
+        else:
+          failure.next_attempt_at = utcnow() + timedelta(seconds=backoff_delay(failure.attempts))
+        db.commit()
+        return
+
+      receipt.pdf_url = pdf_url
+      record_event(db, "receipt.pdf_updated", receipt.id, {"id": receipt.id, "pdf_url": pdf_url})
+      db.delete(failure)
+      db.commit()
+      pdf_cache.discard(receipt.receipt_number)
+      RECEIPTS.inc("upload_retried")
+      logger.info(f"upload retry succeeded receipt_id={receipt_id} attempts={failure.attempts + 1}")
+      if self.on_uploaded:
+        self.on_uploaded(receipt)
+    finally:
+      db.close()
+
+  def run_once(self) -> int:
+    # One sweep. Returns how many receipts this worker claimed.
+    db = SessionLocal()
+    try:
+      claimed = [
+        receipt_id
+        for receipt_id, next_attempt_at in self._due_receipts(db)
+        if self._claim(db, receipt_id, next_attempt_at)
+      ]
+    finally:
+      db.close()
+    if claimed:
+      with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+        for future in [pool.submit(self._retry_one, receipt_id) for receipt_id in claimed]:
+          try:
+            future.result()
+          except Exception as e:
+            logger.warning(f"upload retry crashed error={e!r}")
+    return len(claimed)
+
+  def _run(self):
+    while not self._stop.wait(UPLOAD_RETRY_INTERVAL_SECONDS):
+      try:
+        # A full batch means there's probably more waiting (e.g. a till just synced its offline backlog), keep going
+        while self.run_once() >= UPLOAD_RETRY_BATCH and not self._stop.is_set():
+          pass
+      except Exception as e:
+        logger.warning(f"upload retry sweep failed error={e!r}")
+
+  def start(self):
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._run, name="upload-retrier", daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+    if self._thread:
+      self._thread.join(timeout=5)
+
+
+upload_retrier = UploadRetrier()